@@ -3956,6 +3956,9 @@ class StampRelease(Command):
                 continue
             print 'Found release file %s'%filename
             version = base[len(name)+2:]
+            if '.' not in version:
+                print 'Ignoring release file %s (version number is not <major>.<minor>)'%filename
+                continue
             try:
                 vnum = utils.VersionNumber.from_string(version)
             except GiveUp as e:
@@ -4878,6 +4881,7 @@ class Distribute(CPDCommand):
         * -with-versions
         * -with-vcs
         * -no-muddle-makefile
+        * -hard-links
 
       See below for more information on each.
 
@@ -4988,6 +4992,15 @@ class Distribute(CPDCommand):
     chosen with "distribute_checkout_files" in the build description. It also
     does not affect the "_by_license" distribution.
 
+    If the -hard-links switch is specified, then the files in checkouts and
+    in obj/ and install/ directories are hard linked into the distribution,
+    instead of being copied, wherever that is possible (that is, if the
+    <target_directory> is on the same filesystem as the build tree). This is
+    a lot faster, but a linked file *is* the file in the build tree, so
+    changing either changes both. Only use it for a distribution that is
+    going to be archived (for instance, with tar) and then discarded, not
+    for one that you will build in.
+
     Note that "muddle -n distribute" can be used in the normal manner to see
     what the command would do. It shows the labels that would be distributed,
     and the actions that would be used to do so. This is especially useful for
@@ -5032,7 +5045,8 @@ class Distribute(CPDCommand):
 
     allowed_switches = {'-with-vcs':'with-vcs',
                         '-with-versions':'with-versions',
-                        '-no-muddle-makefile':'no-muddle-makefile'}
+                        '-no-muddle-makefile':'no-muddle-makefile',
+                        '-hard-links':'hard-links'}
 
     def requires_build_tree(self):
         return True
@@ -5048,6 +5062,7 @@ class Distribute(CPDCommand):
         with_versions_dir = ('with-versions' in self.switches)
         with_vcs = ('with-vcs' in self.switches)
         no_muddle_makefile = ('no-muddle-makefile' in self.switches)
+        hard_links = ('hard-links' in self.switches)
         fragments = []
 
         while args:
@@ -5082,7 +5097,8 @@ class Distribute(CPDCommand):
                    with_vcs=with_vcs,
                    no_muddle_makefile=no_muddle_makefile,
                    no_op=self.no_op(),
-                   package_labels=pkg_labels, checkout_labels=co_labels)
+                   package_labels=pkg_labels, checkout_labels=co_labels,
+                   hard_links=hard_links)
 
     def interpret_labels(self, builder, args, initial_list):
         """Return selected packages and checkouts.
@@ -7,6 +7,7 @@ Ugh.
 
 import os
 import stat
+import struct
 
 import muddled.utils as utils
 import muddled.filespec as filespec
@@ -508,6 +509,17 @@ def trace_files(file_list, root):
         trace_files(file_list, c)
 
 
+# The fields of a "newc" (SVR4 portable, no CRC) header, after the magic:
+# thirteen 8-character hexadecimal numbers.
+_NEWC_MAGIC = "070701"
+_NEWC_HEADER = struct.Struct("6s" + "8s"*13)
+
+def _pad4(pos):
+    """
+    Round 'pos' up to the next multiple of 4.
+    """
+    return (pos + 3) & ~3
+
 class Archive(object):
     """
     Represents a CPIO archive.
@@ -521,6 +533,63 @@ class Archive(object):
         self.files = [ ]
 
 
+    @staticmethod
+    def load(path):
+        """
+        Read the "newc" cpio archive at 'path' and return an Archive
+        containing a File for each member, in archive order.
+
+        'path' may also be a file-like object, which is read from its
+        current position.
+
+        The trailer entry is not included. Each File has its contents
+        in its 'data' attribute.
+        """
+        if hasattr(path, "read"):
+            buf = path.read()
+        else:
+            with open(path, "rb") as f_in:
+                buf = f_in.read()
+
+        ar = Archive()
+        pos = 0
+        while True:
+            fields = _NEWC_HEADER.unpack_from(buf, pos)
+            if fields[0] != _NEWC_MAGIC:
+                raise utils.GiveUp("%s: bad cpio magic %r at offset %d"%(path,
+                                   fields[0], pos))
+            (ino, mode, uid, gid, nlink, mtime, data_size,
+             dev_maj, dev_min, rdev_maj, rdev_min,
+             name_size, check) = [int(x, 16) for x in fields[1:]]
+
+            name_start = pos + _NEWC_HEADER.size
+            # name_size includes the terminating NUL
+            name = buf[name_start:name_start + name_size - 1]
+            data_start = _pad4(name_start + name_size)
+            data_end = data_start + data_size
+            if data_end > len(buf):
+                raise utils.GiveUp("%s: cpio archive truncated in "
+                                   "member '%s'"%(path, name))
+            pos = _pad4(data_end)
+
+            if name == "TRAILER!!!":
+                break
+
+            member = File()
+            member.ino = ino
+            member.mode = mode
+            member.uid = uid
+            member.gid = gid
+            member.nlink = nlink
+            member.mtime = mtime
+            member.dev = os.makedev(dev_maj, dev_min)
+            member.rdev = os.makedev(rdev_maj, rdev_min)
+            member.name = name
+            member.data = buf[data_start:data_end]
+            ar.files.append(member)
+
+        return ar
+
     def add_file(self, a_file):
         """
         DANGER WILL ROBINSON! You need to add files in the right order
@@ -539,14 +608,26 @@ class Archive(object):
     def render(self, to_file, logProgress = False):
         """
         Render a CPIO archive to the given file.
+
+        'to_file' may be a filename or a file-like object. We close the file
+        if we opened it, but leave a file-like object open.
         """
 
-        f_out = open(to_file, "wb")
+        if hasattr(to_file, "write"):
+            f_out = to_file
+        else:
+            f_out = open(to_file, "wb")
 
         file_list = list(self.files)
         # There's a trailer on every cpio archive ..
         file_list.append(file_from_data("TRAILER!!!", ""))
 
+        # Keep track of where we are ourselves, so we can work out the
+        # padding without asking the file, and write the padding after
+        # each member's data along with the next member's header.
+        pos = f_out.tell()
+        padding = ""
+
         for f in file_list:
             # We need to know our data size, so pull in the data now.
             if (f.orig_file is not None):
@@ -604,32 +685,33 @@ class Archive(object):
             if (logProgress):
                 print "> Packing %s .. "%(f.name)
 
-            f_out.write("".join(hdr_array))
-            f_out.write(f.name)
-            f_out.write("\0")
+            hdr_array.append(f.name)
+            hdr_array.append("\0")
+            pos += _NEWC_HEADER.size + name_size
 
             # Now we need to pad to a 4-byte boundary.
-            pos = f_out.tell()
-            if (pos%4):
-                for i in range(0, 4-(pos%4)):
-                    f_out.write("\0")
+            hdr_array.append("\0" * (_pad4(pos) - pos))
+            pos = _pad4(pos)
 
+            f_out.write(padding + "".join(hdr_array))
 
             if (file_data is not None):
                 f_out.write(file_data)
+                pos += data_size
 
             # .. and pad again.
-            pos = f_out.tell()
-            if (pos%4):
-                for i in range(0, 4-(pos%4)):
-                    f_out.write("\0")
+            padding = "\0" * (_pad4(pos) - pos)
+            pos = _pad4(pos)
 
             # Make very sure we throw this data away after we're done
             # using it - it's typically several megabytes.
             file_data = None
 
 
-        f_out.close()
+        f_out.write(padding)
+
+        if f_out is not to_file:
+            f_out.close()
         # And that's all, folks.
 
 
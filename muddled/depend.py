@@ -8,6 +8,10 @@ import copy
 from muddled.utils import GiveUp, MuddleBug, label_type_to_tag, LabelType, \
         sort_domains, total_ordering
 
+# Labels we have already parsed in Label.from_string(), by label string.
+# Builds parse the same few label strings over and over again.
+gLabelsFromStrings = {}
+
 @total_ordering
 class Label(object):
     """
@@ -239,6 +243,7 @@ class Label(object):
         self._name = name
         self._role = role
         self._tag = tag
+        self._update_key()
 
         # Flags are *not* immutable
         self.transient = transient
@@ -246,6 +251,17 @@ class Label(object):
         # The "unswept" flag is regarded as internal
         self._unswept = False
 
+    def _update_key(self):
+        """
+        Remember our type, name, role and tag as a tuple, and its hash.
+
+        Call this whenever any of them is changed (which should only be
+        done on a brand new copy of a label). The domain is not included,
+        for the same reason that it is not part of our hash.
+        """
+        self._key = (self._type, self._name, self._role, self._tag)
+        self._hash = hash(self._key)
+
     @property
     def type(self):
         return self._type
@@ -291,6 +307,7 @@ class Label(object):
         if (target._tag != "*"):
             new._tag = target._tag
 
+        new._update_key()
         new.system = target.system
         new.transient = target.transient
         return new
@@ -302,6 +319,7 @@ class Label(object):
         Label._check_part('tag', new_tag)
         cp = self.copy()
         cp._tag = new_tag
+        cp._update_key()
         cp.system = system
         cp.transient = transient
         return cp
@@ -313,6 +331,7 @@ class Label(object):
         Label._check_part('role', new_role)
         cp = self.copy()
         cp._role = new_role
+        cp._update_key()
         return cp
 
     def copy_with_domain(self, new_domain):
@@ -566,18 +585,7 @@ class Label(object):
 
         *Does* take the domains (if any) into account.
         """
-        if self._type != other._type:
-            return False
-        elif self._domain != other._domain:
-            return False
-        elif self._name != other._name:
-            return False
-        elif self._role != other._role:
-            return False
-        elif self._tag != other._tag:
-            return False
-        else:
-            return True
+        return self._key == other._key and self._domain == other._domain
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -620,7 +628,7 @@ class Label(object):
         transient and system flags (since they are defined to be, well,
         transient).
         """
-        return hash( (self._type, self._name, self._role, self._tag) )
+        return self._hash
 
     def _mark_unswept(self):
         """
@@ -835,7 +843,23 @@ class Label(object):
             ...
             GiveUp: Label string 'package:()busybox/*' is not a valid Label
 
+        Each call returns a new Label, even for a string we've seen before:
+
+            >>> a = Label.from_string('package:busybox/installed')
+            >>> b = Label.from_string('package:busybox/installed')
+            >>> a == b, a is b
+            (True, False)
+
         """
+        # Labels are not entirely immutable (their flags and domain can
+        # change), so we always return a new Label, copied from the one we
+        # remembered.
+        known = gLabelsFromStrings.get(label_string)
+        if known is not None:
+            label = Label.__new__(Label)
+            label.__dict__.update(known.__dict__)
+            return label
+
         m = Label.label_string_re.match(label_string)
         if m is None or m.end() != len(label_string):
             raise GiveUp('Label string %s is not a valid'
@@ -855,8 +879,10 @@ class Label(object):
             transient = Label.FLAG_TRANSIENT in flags
             system    = Label.FLAG_SYSTEM in flags
 
-        return Label(type, name, role=role, tag=tag, transient=transient,
-                     system=system, domain=domain)
+        label = Label(type, name, role=role, tag=tag, transient=transient,
+                      system=system, domain=domain)
+        gLabelsFromStrings[label_string] = label.copy()
+        return label
 
     @staticmethod
     def from_fragment(fragment, default_type, default_role=None, default_domain=None):
@@ -1202,15 +1228,10 @@ class Rule(object):
 
         output.append('[')
         if self.deps:
-            deps = []
-            for label in self.deps:
-                if (label.system and showSystem) or ((not label.system) and showUser):
-                    deps.append(label)
+            deps = [label for label in self.deps
+                    if (label.system and showSystem) or ((not label.system) and showUser)]
             deps.sort()
-            deps_output = []
-            for label in deps:
-                deps_output.append(str(label))
-            output.append(", ".join(deps_output))
+            output.append(", ".join(map(str, deps)))
         output.append(']')
         return " ".join(output)
 
@@ -1230,6 +1251,28 @@ class RuleSet(object):
 
     def __init__(self):
         self.map = { }
+        # The targets in self.map that contain wildcards. A definite label
+        # can only match one of these, or a target equal to itself.
+        self._wildcard_targets = [ ]
+
+    def _remember_target(self, target):
+        """
+        Note a new target in self.map
+        """
+        if target.is_wildcard():
+            self._wildcard_targets.append(target)
+
+    def _targets_to_match(self, label):
+        """
+        Return the targets in self.map that might match 'label'.
+        """
+        if label.is_wildcard():
+            return self.map.keys()
+        elif label in self.map:
+            # Use the target we hold, not 'label', since their flags may differ
+            return [self.map[label].target] + self._wildcard_targets
+        else:
+            return self._wildcard_targets
 
     def add(self, rule):
         """
@@ -1244,6 +1287,7 @@ class RuleSet(object):
         inst = self.map.get(rule.target, None)
         if (inst is None):
             self.map[rule.target] = rule
+            self._remember_target(rule.target)
         else:
             inst.merge(rule)
 
@@ -1262,10 +1306,10 @@ class RuleSet(object):
         """
         rules = set()
         if (useMatch):
-            for (k,v) in self.map.items():
+            for k in self._targets_to_match(label):
                 #if (label.match(k) is not None):
                 if label.just_match(k):
-                    rules.add(v)
+                    rules.add(self.map[k])
         elif (useTags):
             rule = self.map.get(label, None)
             if (rule is not None):
@@ -1296,7 +1340,7 @@ class RuleSet(object):
         result_set = set()
 
         if (useMatch):
-            for k in self.map.keys():
+            for k in self._targets_to_match(target):
                 if (k.match(target) is not None):
                     result_set.add(k)
         elif target in self.map.keys():
@@ -1319,6 +1363,7 @@ class RuleSet(object):
         if (createIfNotPresent and (rv is None)):
             rv = Rule(target, None)
             self.map[target] = rv
+            self._remember_target(target)
 
         return rv
 
@@ -1406,6 +1451,7 @@ class RuleSet(object):
 
         # .. and new_map is the new map.
         self.map = new_map
+        self._wildcard_targets = [k for k in new_map if k.is_wildcard()]
 
 
     def to_string(self, matchLabel = None,
@@ -1544,13 +1590,13 @@ def label_set_to_string(label_set, start_with="[", end_with="]", join_with=", "
 def rule_list_to_string(rule_list):
     """
     Utility function to convert a rule list to a string.
+
+        >>> r1 = Rule(Label.from_string('package:fred/built'), None)
+        >>> r2 = Rule(Label.from_string('package:jim/built'), None)
+        >>> print rule_list_to_string([r1, r2])
+        [ package:fred/built <- [ ], package:jim/built <- [ ],  ]
     """
-    str_list = [ "[ " ]
-    for i in rule_list:
-        str_list.append(i.__str__())
-        str_list.append(", ")
-    str_list.append(" ]")
-    return "".join(str_list)
+    return "[ %s ]"%"".join(["%s, "%i for i in rule_list])
 
 
 def label_list_to_string(labels, join_with=' '):
@@ -1729,24 +1775,27 @@ def required_by(ruleset, label, useTags = True, useMatch = True):
     for r in rules:
         depends.add(r.target)
 
-
+    # Only the labels we added last time round can bring in anything new,
+    # so there's no need to look at the whole of 'depends' again.
+    frontier = depends
     while True:
         extra = set()
 
-        for dep in depends:
+        for dep in frontier:
             # Merge in everything that depends on dep
             new_rules = ruleset.rules_which_depend_on(dep, useTags, useMatch = useMatch)
 
             # Each target depends on us ..
             for rule in new_rules:
                 # If we're not already in the depends set, add us ..
-                if (not (rule.target in depends)):
+                if (rule.target not in depends and rule.target not in extra):
                     return_val.append(rule.target)
                     extra.add(rule.target)
 
         # Anything to add?
         if len(extra) > 0:
             depends = depends.union(extra)
+            frontier = extra
         else:
             return depends
 
@@ -1808,6 +1857,7 @@ def normalise_checkout_label(label, tag='*'):
     else:
         new = label.copy_with_tag(tag)
         new._role = None    # a bit naughty, but the simplest way
+        new._update_key()
         return new
 
 # Some simple ways of constructing labels
@@ -46,6 +46,8 @@ from muddled.withdir import Directory
 
 DEBUG=False
 VERBOSE=False       # should copy_without be quiet
+HARD_LINKS=False    # should we hard link (large) files rather than copy them
+                    # - set by distribute() for the duration of a distribution
 
 # Distribution names, with the license categories they distribute something
 # from. Note that distributing something from 'gpl' or 'open-source' doesn't
@@ -930,7 +932,8 @@ def _actually_distribute_checkout(builder, label, target_dir, copy_vcs):
         print '  to   %s'%co_tgt_dir
         if without:
             print '  without %s'%without
-    copy_without(co_src_dir, co_tgt_dir, without, preserve=True, verbose=VERBOSE)
+    copy_without(co_src_dir, co_tgt_dir, without, preserve=True, verbose=VERBOSE,
+                 link=HARD_LINKS)
 
     # We mustn't forget to set the appropriate tags in the target .muddle/
     # directory
@@ -1114,7 +1117,8 @@ def _actually_distribute_obj(builder, label, target_dir):
         print '    from %s'%obj_dir
         print '    to   %s'%tgt_obj_dir
 
-    copy_without(obj_dir, tgt_obj_dir, preserve=True, verbose=VERBOSE)
+    copy_without(obj_dir, tgt_obj_dir, preserve=True, verbose=VERBOSE,
+                 link=HARD_LINKS)
 
     # We mustn't forget to set the appropriate package tags
     _set_package_tags(builder, label, target_dir,
@@ -1159,7 +1163,8 @@ def _actually_distribute_install(builder, label, target_dir):
             if DEBUG:
                 print 'and from %s'%install_dir
                 print '      to %s'%tgt_install_dir
-            copy_without(install_dir, tgt_install_dir, preserve=True, verbose=VERBOSE)
+            copy_without(install_dir, tgt_install_dir, preserve=True,
+                         verbose=VERBOSE, link=HARD_LINKS)
 
     # Set the appropriate package tags
     _set_package_tags(builder, label, target_dir,
@@ -1914,7 +1919,7 @@ def select_all_binary_nonprivate_packages(builder, name, with_muddle_makefile, j
 
 def distribute(builder, name, target_dir, with_versions_dir=False,
                with_vcs=False, no_muddle_makefile=False, no_op=False,
-               package_labels=None, checkout_labels=None):
+               package_labels=None, checkout_labels=None, hard_links=False):
     """Distribute using distribution context 'name', to 'target_dir'.
 
     The DistributeContext called 'name' must exist.
@@ -1963,6 +1968,14 @@ def distribute(builder, name, target_dir, with_versions_dir=False,
     NB: We assume that each package label in 'package_labels' has had the
     checkouts it directly depends upon added to 'checkout_labels' by the
     caller. Also, all labels must have their tag as '*'.
+
+    If 'hard_links' is true, then the files in checkout, obj/ and install/
+    directories will be hard linked into the distribution, rather than
+    copied, wherever that is possible (i.e., when 'target_dir' is on the
+    same filesystem as the build tree). This is much faster, but the linked
+    files are shared with the build tree, so changing one changes the other.
+    It is thus only suitable for a distribution that is going to be archived
+    or otherwise copied elsewhere, not for one that is going to be built in.
     """
 
     if name not in the_distributions.keys():
@@ -2164,5 +2177,10 @@ def distribute(builder, name, target_dir, with_versions_dir=False,
 
     print 'Building %d /distribute label%s'%(num_labels,
             '' if num_labels==1 else 's')
-    for label in distribution_labels:
-        builder.build_label(label)
+    global HARD_LINKS
+    HARD_LINKS = hard_links
+    try:
+        for label in distribution_labels:
+            builder.build_label(label)
+    finally:
+        HARD_LINKS = False
@@ -104,12 +104,26 @@ class EnvExpr(object):
                                                                         self.type))
 
     def to_sh(self, doQuote):
+        parts = [ ]
+        self._add_sh_parts(doQuote, parts)
+        return "".join(parts)
+
+    def _add_sh_parts(self, doQuote, parts):
+        """
+        Append the pieces of our to_sh() value to 'parts'.
+
+        Nested catenations all add to the same list, so we only join
+        once, at the top.
+        """
         if (self.type == EnvExpr.StringType):
-            return "".join(map(lambda x: utils.maybe_shell_quote(x, doQuote), self.values))
+            for x in self.values:
+                parts.append(utils.maybe_shell_quote(x, doQuote))
         elif (self.type == EnvExpr.RefType):
-            return "".join(map(lambda x: utils.maybe_shell_quote("$%s"%x, doQuote), self.values))
+            for x in self.values:
+                parts.append(utils.maybe_shell_quote("$%s"%x, doQuote))
         else:
-            return "".join(map(lambda x: x.to_sh(doQuote), self.values))
+            for x in self.values:
+                x._add_sh_parts(doQuote, parts)
 
     def to_py(self, env_var):
         """
@@ -118,15 +132,22 @@ class EnvExpr(object):
         correct value for this variable.
         """
         r_list = [ ]
+        self._add_py_parts(env_var, r_list)
+        return r_list
+
+    def _add_py_parts(self, env_var, r_list):
+        """
+        Append the expressions for to_py() to 'r_list'.
+        """
         if (self.type == EnvExpr.StringType):
-            r_list.extend(map(lambda x: "\"%s\""%(x), self.values))
+            for x in self.values:
+                r_list.append("\"%s\""%(x))
         elif (self.type == EnvExpr.RefType):
-            r_list.extend(map(lambda x: "%s[\"%s\"]"%(env_var,x), self.values))
+            for x in self.values:
+                r_list.append("%s[\"%s\"]"%(env_var,x))
         else:
             for i in self.values:
-                r_list.extend(i.to_py(env_var))
-
-        return r_list
+                i._add_py_parts(env_var, r_list)
 
     def to_c(self, var, prefix):
         """
@@ -163,14 +184,21 @@ class EnvExpr(object):
 
     def to_value(self, env):
         r_list = [ ]
+        self._add_value_parts(env, r_list)
+        return "".join(r_list)
+
+    def _add_value_parts(self, env, r_list):
+        """
+        Append the pieces of our to_value() value to 'r_list'.
+        """
         if (self.type == EnvExpr.StringType):
             r_list.extend(self.values)
         elif (self.type == EnvExpr.RefType):
-            r_list.extend(map(lambda x: env.get(x, ""), self.values))
+            for x in self.values:
+                r_list.append(env.get(x, ""))
         else:
-            r_list.extend(map(lambda x: x.to_value(env), self.values))
-
-        return "".join(r_list)
+            for x in self.values:
+                x._add_value_parts(env, r_list)
 
     def augment_dependency_set(self, a_set):
         """
@@ -407,12 +435,10 @@ class EnvBuilder(object):
         if self.erased:
             return None
 
-        val_array = [ ]
-
-        val_array.extend(map(lambda x: x.to_value(env), self.prepend_list))
+        val_array = [x.to_value(env) for x in self.prepend_list]
         if (inOldValue is not None) and self.retain_old_value:
             val_array.append(inOldValue)
-        val_array.extend(map(lambda x: x.to_value(env), self.append_list))
+        val_array.extend([x.to_value(env) for x in self.append_list])
 
         if (self.env_type == EnvType.SimpleValue):
             return "".join(val_array)
@@ -3,6 +3,7 @@ FileSpecs: a cheap and cheerful way to specify files for the
 purposes of deployment instructions
 """
 
+import bisect
 import re
 import os
 
@@ -42,6 +43,43 @@ class FileSpecDataProvider(object):
                           "try a subclass")
 
 
+# Compiled regular expressions for the specs we've seen, by spec. The same
+# few specs tend to be used by many filespecs.
+_spec_re_cache = {}
+
+def _compile_spec(spec):
+    """
+    Return the compiled regular expression for 'spec'.
+    """
+    try:
+        return _spec_re_cache[spec]
+    except KeyError:
+        # Add a synthetic $ or we'll get a lot of odd prefix matches.
+        spec_re = re.compile("%s$"%spec)
+        _spec_re_cache[spec] = spec_re
+        return spec_re
+
+# A spec that just looks for a literal string anywhere, like "(.*)b(.*)"
+_substring_spec_re = re.compile(r"^(?:\(\.\*\)|\.\*)([A-Za-z0-9_/ -]+)(?:\(\.\*\)|\.\*)$")
+
+def _spec_substring(spec):
+    """
+    If 'spec' just looks for a literal string anywhere in a name, return
+    that string, otherwise None.
+
+        >>> print _spec_substring('(.*)b(.*)')
+        b
+        >>> print _spec_substring('.*lib/foo.*')
+        lib/foo
+        >>> print _spec_substring('lib.*')
+        None
+    """
+    m = _substring_spec_re.match(spec)
+    if m is None:
+        return None
+    else:
+        return m.group(1)
+
 class FileSpec(object):
     """
     Represents a (possibly recursive) file specification. Filespecs are
@@ -64,8 +102,8 @@ class FileSpec(object):
     def __init__(self, root, spec, allUnder = False, allRegex = False):
         self.root = root
         self.spec = spec
-        # Add a synthetic $ or we'll get a lot of odd prefix matches.
-        self.spec_re = re.compile("%s$"%spec)
+        self.spec_re = _compile_spec(spec)
+        self.spec_substring = _spec_substring(spec)
         self.all_under = allUnder
         self.all_regex = allRegex
 
@@ -86,6 +124,21 @@ class FileSpec(object):
         # Hmm .. it appears we have no choice.
         return True
 
+    def _matching_names(self, names):
+        """
+        Return those of 'names' that match our spec.
+        """
+        spec_re = self.spec_re
+        substring = self.spec_substring
+        if substring is None:
+            return [f for f in names if spec_re.match(f) is not None]
+        else:
+            # '.' doesn't match a newline, so leave any such names to the
+            # regular expression
+            return [f for f in names
+                    if (substring in f if '\n' not in f
+                        else spec_re.match(f) is not None)]
+
     def match(self, data_provider, vroot=None):
         """
         Match this filespec with a data provider, returning a set of
@@ -111,12 +164,10 @@ class FileSpec(object):
         all_in_root = data_provider.list_files_under(self.root, self.all_under,
                                                      vroot = vroot)
         #print 'all_in_root=%s'%all_in_root
-        for f in all_in_root:
-            #print "Match f  = %s against spec = %s"%(f, self.spec)
-            if self.spec_re.match(f) is not None:
-                # Gotcha
-                #print "Found match = %s"%os.path.join(self.root, f)
-                return_set.add(os.path.join(self.root, f))
+        for f in self._matching_names(all_in_root):
+            # Gotcha
+            #print "Found match = %s"%os.path.join(self.root, f)
+            return_set.add(os.path.join(self.root, f))
 
         #print 'RETURN SET', return_set
 
@@ -224,37 +275,55 @@ class ListFileSpecDataProvider(object):
 
     def __init__(self, file_list):
         self.file_list = file_list
+        # Split each path into its components once, rather than on every
+        # call of list_files_under(), and sort them so that the paths under
+        # any directory are next to each other
+        self.sorted_parts = sorted(_path_components(f) for f in file_list)
 
     def list_files_under(self, dir, recursively = False, vroot = None):
-        # _really_ simple-minded ..
-        result = [ ]
-        for f in self.file_list:
-            d = dir
+        if not dir:
+            return [f for f in self.file_list
+                    if f and (recursively or f.find("/") == -1)]
 
-            # Remove any common prefix
-            while d and f:
-                ld, restd = utils.split_path_left(d)
-                fd, restf = utils.split_path_left(f)
-                if ld != fd:
-                    break
-                d, f = restd, restf
+        dir_parts = _path_components(dir)
+        num_dir_parts = len(dir_parts)
 
-            if d:               # We don't actually start with 'dir'
-                continue
-
-            if not f:           # We *were* 'dir'
-                continue
+        # Everything under 'dir' sorts after it, and before anything that
+        # doesn't start with it
+        result = [ ]
+        sorted_parts = self.sorted_parts
+        for idx in xrange(bisect.bisect_right(sorted_parts, dir_parts),
+                          len(sorted_parts)):
+            parts = sorted_parts[idx]
+            if parts[:num_dir_parts] != dir_parts:
+                break
 
             if recursively:
-                result.append(f)
-            else:
-                if f.find("/") == -1:
-                    # Yep
-                    result.append(f)
+                result.append("/".join(parts[num_dir_parts:]))
+            elif len(parts) == num_dir_parts + 1:
+                # Yep
+                result.append(parts[-1])
 
         return result
 
 
+def _path_components(path):
+    """
+    Split 'path' into a tuple of its components, as repeated use of
+    ``utils.split_path_left()`` would. An absolute path starts with ''.
+
+        >>> _path_components('/a//b/c/')
+        ('', 'a', 'b', 'c')
+        >>> _path_components('a/b')
+        ('a', 'b')
+    """
+    parts = []
+    while path:
+        head, path = utils.split_path_left(path)
+        parts.append(head)
+    return tuple(parts)
+
+
 class FSFileSpecDataProvider(object):
     """
     A FileSpecDataProvider rooted at a particular point in the filesystem
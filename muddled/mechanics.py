@@ -1507,19 +1507,9 @@ class Builder(object):
             # Nothing to do.
             return [ ]
 
-        # Now sort in order of first component
-        def bespoke_cmp(a,b):
-            (p,q,r) = a
-            (x,y,z) = b
-
-            if (p<x):
-                return -1
-            elif (p>x):
-                return 1
-            else:
-                return 0
-
-        to_apply.sort(bespoke_cmp)
+        # Now sort in order of first component (the sort is stable, so
+        # environments that match equally well stay in the same order)
+        to_apply.sort(key=lambda x: x[0])
         return to_apply
 
 
@@ -635,6 +635,31 @@ def parse_instruction(input_stream, node):
         print "parse_instruction(): ends (2)"
     node.append_child(result)
 
+# A plain ``${query}``, with no functions, quoting or escapes in it
+_simple_query_re = re.compile(r'\$\{([^$\\":}]*)\}')
+
+def _subst_simple_str(in_str, xml_doc, env):
+    """
+    Substitute in_str as subst_str() would, but only if all it contains
+    is plain ``${query}`` substitutions.
+
+    Returns the substituted string, or None if in_str needs the full parser.
+    """
+    # This gives us [text, query, text, query, ..., text]
+    parts = _simple_query_re.split(in_str)
+    for text in parts[::2]:
+        if '$' in text:
+            return None
+
+    for i in range(1, len(parts), 2):
+        key_name = parts[i].strip()
+        res = query_string_value(xml_doc, env, key_name)
+        if (res is None):
+            raise utils.GiveUp("Attempt to substitute key '%s' which does not exist."%key_name)
+        parts[i] = res
+
+    return "".join(parts)
+
 def subst_str(in_str, xml_doc, env):
     """
     Substitute ``${...}`` in in_str with the appropriate objects - if XML
@@ -651,6 +676,12 @@ def subst_str(in_str, xml_doc, env):
 
     """
 
+    # Most text only uses simple substitutions (if any), and doesn't need
+    # to be parsed one character at a time
+    result = _subst_simple_str(in_str, xml_doc, env)
+    if result is not None:
+        return result
+
     stream = PushbackInputStream(in_str)
     top_node = TreeNode(TreeNode.ContainerType, stream)
     parse_document(stream, top_node, None, False)
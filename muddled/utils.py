@@ -2,9 +2,12 @@
 Muddle utilities.
 """
 
+import bisect
 import errno
+import functools
 import hashlib
 import imp
+import multiprocessing
 import os
 import pipes
 import pwd
@@ -24,9 +27,18 @@ import xml.dom
 import xml.dom.minidom
 from collections import MutableMapping, Mapping, namedtuple
 from fnmatch import fnmatchcase
+from multiprocessing.pool import ThreadPool
 from ConfigParser import RawConfigParser
 from StringIO import StringIO
 
+try:
+    from os import scandir          # Python 3.5 onwards
+except ImportError:
+    try:
+        from scandir import scandir # the backport, if it is installed
+    except ImportError:
+        scandir = None
+
 try:
     import curses
 except:
@@ -521,15 +533,21 @@ def pad_to(str, val, pad_with = " "):
 
     return "".join(arr)
 
+# <vcs>+<scheme>:<rest>, as understood by split_vcs_url()
+_vcs_url_re = re.compile(r"^([A-Za-z]+)\+([A-Za-z+]+):(.*)$")
+
 def split_vcs_url(url):
     """
     Split a URL into a vcs and a repository URL. If there's no VCS
     specifier, return (None, None).
-    """
 
-    the_re = re.compile("^([A-Za-z]+)\+([A-Za-z+]+):(.*)$")
+        >>> split_vcs_url('Git+ssh://git@example.com/repo')
+        ('git', 'ssh://git@example.com/repo')
+        >>> split_vcs_url('http://example.com/repo')
+        (None, None)
+    """
 
-    m = the_re.match(url)
+    m = _vcs_url_re.match(url)
     if (m is None):
         return (None, None)
 
@@ -620,7 +638,7 @@ def _rationalise_cmd(thing):
     return thing
 
 
-def shell(thing, env=None, show_command=True):
+def shell(thing, env=None, show_command=True, cwd=None):
     """Run the command 'thing' in the shell.
 
     If 'thing' is a string (e.g., "ls -l"), then it will be used as it is
@@ -636,6 +654,9 @@ def shell(thing, env=None, show_command=True):
     If 'show_command' is true, then "> <thing>" will be printed out
     before running the command.
 
+    If 'cwd' is given, then the command is run in that directory, rather
+    than the current directory.
+
     The output of the command will always be printed out as it runs.
 
     If the command returns a non-zero return code, then a ShellError will
@@ -661,7 +682,7 @@ def shell(thing, env=None, show_command=True):
     if env is None: # so, for instance, an empty dictionary is allowed
         env = os.environ
     try:
-        subprocess.check_call(thing, shell=True)
+        subprocess.check_call(thing, shell=True, cwd=cwd)
     except subprocess.CalledProcessError as e:
         # Unfortunately, e.output will actually be None, since it is only
         # populated for check_output.
@@ -1080,7 +1101,40 @@ def copy_file_metadata(from_path, to_path):
         if os.geteuid() == 0:
             os.chown(to_path, st.st_uid, st.st_gid)
 
-def copy_file(from_path, to_path, object_exactly=False, preserve=False, force=False):
+# The errors from os.link() that mean we should copy the file instead
+_LINK_FALLBACK_ERRNOS = (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK)
+
+def _link_file(from_path, to_path):
+    """Try to make 'to_path' a hard link to 'from_path'.
+
+    Returns True if 'to_path' is now the same file as 'from_path', or False
+    if the file should be copied instead.
+    """
+    try:
+        os.link(from_path, to_path)
+        return True
+    except OSError as e:
+        if e.errno in _LINK_FALLBACK_ERRNOS:
+            return False
+        if e.errno != errno.EEXIST:
+            raise
+    # Typically, we're distributing into the same place a second time
+    if os.path.samefile(from_path, to_path):
+        return True
+    # Leave anything we wouldn't overwrite by copying to copy_file()
+    if os.path.isdir(to_path) or os.path.islink(to_path):
+        return False
+    os.remove(to_path)
+    try:
+        os.link(from_path, to_path)
+        return True
+    except OSError as e:
+        if e.errno in _LINK_FALLBACK_ERRNOS:
+            return False
+        raise
+
+def copy_file(from_path, to_path, object_exactly=False, preserve=False, force=False,
+              link=False):
     """
     Copy a file (either a "proper" file, not a directory, or a symbolic link).
 
@@ -1101,8 +1155,20 @@ def copy_file(from_path, to_path, object_exactly=False, preserve=False, force=Fa
 
     If 'force' is true, then if a target file is not writeable, try removing it
     and then copying it.
+
+    If 'link' is true, then try to make 'to_path' a hard link to 'from_path',
+    instead of copying it. If 'to_path' is already that same file, there is
+    nothing to do, and if it is some other file, it is replaced by the link.
+    If linking is not possible (for instance, because they are on different
+    filesystems), then the file is copied as normal. Beware that a linked
+    file *is* the original file, so changing the content of either changes
+    both.
     """
 
+    if link and not (object_exactly and os.path.islink(from_path)):
+        if _link_file(from_path, to_path):
+            return
+
     if object_exactly and os.path.islink(from_path):
         linkto = os.readlink(from_path)
         if os.path.islink(to_path):
@@ -1143,13 +1209,17 @@ def recursively_copy(from_dir, to_dir, object_exactly=False, preserve=True, forc
                  preserve=preserve, force=force)
 
 
+# Paths without these in them (and not ending with a separator) are left
+# alone by os.path.normpath. os.curdir also catches os.pardir.
+_doubled_sep = os.sep + os.sep
+
 def split_path_left(in_path):
     """
     Given a path ``a/b/c ...``, return a pair
     ``(a, b/c..)`` - ie. like ``os.path.split()``, but leftward.
 
-    What we actually do here is to split the path until we have
-    nothing left, then take the head and rest of the resulting list.
+    What we actually do here is to normalise the path, and then split it
+    at the first separator.
 
     For instance:
 
@@ -1188,33 +1258,17 @@ def split_path_left(in_path):
 
     # Remove redundant sequences of '//'
     # This reduces paths like '///a//b/c' to '/a/b/c', but unfortunately
-    # it leaves '//a/b/c' untouched
-    in_path = os.path.normpath(in_path)
-
-    remains = in_path
-    lst = [ ]
-
-    while remains and remains not in ("/", "//"):
-        remains, end = os.path.split(remains)
-        lst.append(end)
-
-    if remains in ("/", "//"):
-        lst.append("")
+    # it leaves '//a/b/c' untouched. Most paths are already normalised,
+    # though, and for those we can skip it.
+    if (_doubled_sep in in_path or os.curdir in in_path or
+            in_path.endswith(os.sep)):
+        in_path = os.path.normpath(in_path)
 
-    # Our list is in reverse order, so ..
-    lst.reverse()
-
-    if False:
-        rp = lst[1]
-        for i in lst[2:]:
-            rp = os.path.join(rp, i)
-    else:
-        if len(lst) > 1:
-            rp = os.path.join(*lst[1:])
-        else:
-            rp = ""
+    if in_path.startswith(os.sep):
+        return ('', in_path.lstrip(os.sep))
 
-    return (lst[0], rp)
+    head, sep, rest = in_path.partition(os.sep)
+    return (head, rest)
 
 
 def print_string_set(ss):
@@ -1227,12 +1281,22 @@ def print_string_set(ss):
 
     return " ".join(result)
 
+# The characters that c_escape() escapes. Backslash must come first, so that
+# we don't escape the backslashes we add for the others.
+_c_escape_chars = ('\\', '\r', '\n', '"', "'")
+
 def c_escape(v):
     """
     Escape sensitive characters in v.
+
+        >>> print c_escape('say "hi"')
+        say \\"hi\\"
     """
 
-    return re.sub(r'([\r\n"\'\\])', r'\\\1', v)
+    for c in _c_escape_chars:
+        if c in v:
+            v = v.replace(c, '\\' + c)
+    return v
 
 def replace_root_name(base, replacement, filename):
     """
@@ -1240,10 +1304,9 @@ def replace_root_name(base, replacement, filename):
     at the start of filename.
     """
     #print "replace_root_name %s, %s, %s"%(base,replacement, filename)
-    base_len = len(base)
     if (filename.startswith(base)):
-        left = replacement + filename[base_len:]
-        if len(left) > 1 and left[:2] == '//':
+        left = replacement + filename[len(base):]
+        if left.startswith('//'):
             left = left[1:]
         return left
     else:
@@ -1290,49 +1353,143 @@ def xml_elem_with_child(doc, elem_name, child_text):
     return el
 
 
-def _copy_without(src, dst, ignored_names, object_exactly, preserve, force):
+def _link_and_dir(path):
     """
-    The insides of copy_without. See that for more documentation.
+    Return (is_link, is_dir) for 'path'.
 
-    'ignored_names' must be a sequence of filenames to ignore (but may be empty).
+    This is os.path.islink() and os.path.isdir(), but only needs a single
+    lstat, unless 'path' is a symbolic link. 'is_dir' is true for a symbolic
+    link to a directory.
     """
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return False, False
+    if stat.S_ISLNK(mode):
+        return True, os.path.isdir(path)
+    else:
+        return False, stat.S_ISDIR(mode)
 
-    # Inspired by the example for shutil.copytree in the Python 2.6 documentation
+def _dir_entries(path):
+    """
+    Yield (name, is_link, is_dir) for each entry in the directory 'path'.
 
-    names = os.listdir(src)
+    'is_dir' is true for a symbolic link to a directory.
 
-    if True:
-        ensure_dir(dst, verbose=False)
+    If we have scandir, we use it, as (on most systems) it can tell us what
+    each entry is without having to stat it.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            yield entry.name, entry.is_symlink(), entry.is_dir()
     else:
-        if not os.path.exists(dst):
-            os.makedirs(dst)
+        for name in os.listdir(path):
+            is_link, is_dir = _link_and_dir(os.path.join(path, name))
+            yield name, is_link, is_dir
 
-    for name in names:
-        if name in ignored_names:
-            continue
+def _gather_copy_without(src, dst, ignored_names, object_exactly):
+    """
+    Walk 'src', working out what _copy_without needs to do.
 
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
+    Returns a pair of lists, (dirs, files). 'dirs' is a list of (srcdir,
+    dstdir) pairs in top-down order, starting with (src, dst). 'files' is a
+    list of (srcname, dstname) pairs for everything else - if
+    'object_exactly' is true, this includes symbolic links to directories.
+    """
+    dirs = []
+    files = []
+    pending = [(src, dst)]
+    while pending:
+        srcdir, dstdir = pending.pop()
+        dirs.append((srcdir, dstdir))
         try:
-            if object_exactly and os.path.islink(srcname):
-                copy_file(srcname, dstname, object_exactly=True, preserve=preserve)
-            elif os.path.isdir(srcname):
-                _copy_without(srcname, dstname, ignored_names=ignored_names,
-                              object_exactly=object_exactly, preserve=preserve,
-                              force=force)
+            entries = list(_dir_entries(srcdir))
+        except OSError as e:
+            raise GiveUp('Unable to read directory %s: %s'%(srcdir, e))
+
+        for name, is_link, is_dir in entries:
+            if name in ignored_names:
+                continue
+            srcname = os.path.join(srcdir, name)
+            dstname = os.path.join(dstdir, name)
+            if is_dir and not (object_exactly and is_link):
+                pending.append((srcname, dstname))
             else:
-                copy_file(srcname, dstname, object_exactly=object_exactly,
-                          preserve=preserve, force=force)
-        except (IOError, os.error), why:
-            raise GiveUp('Unable to copy %s to %s: %s'%(srcname, dstname, why))
+                files.append((srcname, dstname))
+    return dirs, files
+
+def _copy_without_file(args):
+    """
+    Copy a single file for _copy_without.
 
+    Returns None if all went well, or a string describing the problem.
+    """
+    srcname, dstname, object_exactly, preserve, force, link = args
     try:
-        copy_file_metadata(src, dst)
-    except OSError, why:
-        raise GiveUp('Unable to copy properties of %s to %s: %s'%(src, dst, why))
+        copy_file(srcname, dstname, object_exactly=object_exactly,
+                  preserve=preserve, force=force, link=link)
+    except (IOError, os.error), why:
+        return 'Unable to copy %s to %s: %s'%(srcname, dstname, why)
+    return None
+
+def _default_copy_workers():
+    """
+    How many threads should _copy_without use by default?
+    """
+    try:
+        return min(32, multiprocessing.cpu_count() * 4)
+    except NotImplementedError:
+        return 4
+
+def _copy_without(src, dst, ignored_names, object_exactly, preserve, force,
+                  max_workers=None, link=False):
+    """
+    The insides of copy_without. See that for more documentation.
+
+    'ignored_names' must be a sequence of filenames to ignore (but may be empty).
+
+    We walk the source tree once, create all the target directories, and
+    then copy the files using a pool of (at most) 'max_workers' threads, so
+    that we are not waiting for each (small) file copy to finish before
+    starting the next. Directory metadata is copied last, once all the files
+    are in place.
+    """
+
+    dirs, files = _gather_copy_without(src, dst, ignored_names, object_exactly)
+
+    for srcdir, dstdir in dirs:
+        ensure_dir(dstdir, verbose=False)
+
+    if max_workers is None:
+        max_workers = _default_copy_workers()
+    max_workers = min(max_workers, len(files))
+
+    tasks = [(srcname, dstname, object_exactly, preserve, force, link)
+             for srcname, dstname in files]
+    if max_workers > 1:
+        pool = ThreadPool(max_workers)
+        try:
+            problems = pool.map(_copy_without_file, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        problems = map(_copy_without_file, tasks)
+
+    problems = [p for p in problems if p is not None]
+    if problems:
+        raise GiveUp('\n'.join(problems))
+
+    # Deepest directories first, so that we don't (for instance) make a
+    # directory read-only before we've finished with its subdirectories
+    for srcdir, dstdir in reversed(dirs):
+        try:
+            copy_file_metadata(srcdir, dstdir)
+        except OSError, why:
+            raise GiveUp('Unable to copy properties of %s to %s: %s'%(srcdir, dstdir, why))
 
 def copy_without(src, dst, without=None, object_exactly=True, preserve=False,
-                 force=False, verbose=True):
+                 force=False, verbose=True, max_workers=None, link=False):
     """
     Copy files from the 'src' directory to the 'dst' directory, without those in 'without'
 
@@ -1351,6 +1508,12 @@ def copy_without(src, dst, without=None, object_exactly=True, preserve=False,
 
     If 'verbose' is true (the default), print out what we're copying.
 
+    If 'max_workers' is given, it is the maximum number of threads to use
+    for copying files. The default is four per CPU, up to 32.
+
+    If 'link' is true, then files are hard linked rather than copied, where
+    that is possible - see copy_file() for the caveats.
+
     Creates directories in the destination, if necessary.
 
     Uses copy_file() to copy each file.
@@ -1367,7 +1530,8 @@ def copy_without(src, dst, without=None, object_exactly=True, preserve=False,
             print 'ignoring %s'%without
         print
 
-    _copy_without(src, dst, ignored_names, object_exactly, preserve, force)
+    _copy_without(src, dst, ignored_names, object_exactly, preserve, force,
+                  max_workers, link)
 
 def copy_name_list_with_dirs(file_list, old_root, new_root,
                              object_exactly = True, preserve = False):
@@ -1380,10 +1544,15 @@ def copy_name_list_with_dirs(file_list, old_root, new_root,
     old_root is the old root directory
     new_root is where we want them copied
     """
-    for f in file_list:
-        tgt_name = replace_root_name(old_root, new_root, f)
-        target_dir = os.path.dirname(tgt_name)
+    targets = [ (f, replace_root_name(old_root, new_root, f)) for f in file_list ]
+
+    # Many of the files are likely to share a directory, so only make sure
+    # that each directory exists once
+    target_dirs = set(os.path.dirname(tgt_name) for f, tgt_name in targets)
+    for target_dir in sorted(target_dirs):
         ensure_dir(target_dir)
+
+    for f, tgt_name in targets:
         copy_file(f, tgt_name, object_exactly, preserve)
 
 
@@ -1439,6 +1608,10 @@ def split_domain(domain_name):
         Traceback (most recent call last):
         ...
         GiveUp: Domain name "a(b(c)(d))" has 'sibling' sub-domains
+        >>> split_domain('aa)(ab)')
+        Traceback (most recent call last):
+        ...
+        GiveUp: Domain name "aa)(ab)" has 'sibling' sub-domains
 
     If we're given '' or None, we return [''], "normalising" the domain name.
 
@@ -1450,9 +1623,12 @@ def split_domain(domain_name):
     if domain_name is None:
         return ['']
 
+    # The commonest case is a domain with no sub-domains
     if '(' not in domain_name:
         return [domain_name]
 
+    # A ')(' may come before the first '(' in a malformed name, so we must
+    # look at all of it
     if ')(' in domain_name:
         raise GiveUp('Domain name "%s" has '
                       "'sibling' sub-domains"%domain_name)
@@ -1500,24 +1676,19 @@ def sort_domains(domains):
     >>> sort_domains(a)
     ['+1', '+1(+2)', '+1(+2(+4))', '+1(+2(+4(+4)))', '+1(+3)', '-2', 'a', 'a(a)', 'a(b(c1))', 'a(b(c2))', 'b', 'b(a)', 'b(b)']
 
-    If we're given a domain name that is None, we'll replace it with ''.
-    """
-    name_lists = []
-    for domain in domains:
-        # 'fred(jim)' becomes ['fred', 'jim']
-        # '' and None become ['']
-        name_lists.append(split_domain(domain))
+    Sub-domains sort immediately after their parent domain:
 
-    # ['fred', 'jim'] becomes 'fred~jim'
-    domain_strings = map('~'.join, name_lists)
-    # And sorting should now do what we want
-    domain_strings.sort()
+    >>> sort_domains(['ab', 'a(b)', 'a'])
+    ['a', 'a(b)', 'ab']
 
-    result = []
-    for thing in domain_strings:
-        result.append(join_domain(thing.split('~')))
+    If we're given a domain name that is None, we'll replace it with ''.
+    """
+    # 'fred(jim)' sorts as ('fred', 'jim'), and '' sorts as ('',)
+    return sorted(('' if domain is None else domain for domain in domains),
+                  key=lambda domain: tuple(split_domain(domain)))
 
-    return result
+# Domain sub-paths we have already calculated, by domain name
+gDomainSubpaths = {}
 
 def domain_subpath(domain_name):
     """Calculate the sub-path for a given domain name.
@@ -1539,12 +1710,20 @@ def domain_subpath(domain_name):
     if domain_name is None:
         return ''
 
+    try:
+        return gDomainSubpaths[domain_name]
+    except KeyError:
+        pass
+
     parts = []
     for thing in split_domain(domain_name):
         parts.append('domains')
         parts.append(thing)
 
-    return os.path.join(*parts)
+    # None of the parts contain a separator, so we don't need os.path.join
+    subpath = os.sep.join(parts)
+    gDomainSubpaths[domain_name] = subpath
+    return subpath
 
 
 gArchName = None
@@ -1557,32 +1736,25 @@ def arch_name():
     global gArchName
 
     if (gArchName is None):
-        # This is what the docs say you should do. Ugh.
-        x = subprocess.Popen(["uname", "-m"], stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE).communicate()[0]
-        gArchName = x.strip()
+        # The same as 'uname -m', but without running a subprocess
+        gArchName = os.uname()[4]
 
     return gArchName
 
 
-def unescape_backslashes(str):
-    """
-    Replace every string '\\X' with X, as if you were a shell
-    """
+# Matches a backslash and the character (if any) that it escapes
+_unescape_backslash_re = re.compile(r'\\(.?)', re.DOTALL)
 
-    wasBackslash = False
-    result = [ ]
-    for i in str:
-        if (wasBackslash):
-            result.append(i)
-            wasBackslash = False
-        else:
-            if (i == '\\'):
-                wasBackslash = True
-            else:
-                result.append(i)
+def unescape_backslashes(str):
+    r"""
+    Replace every string '\X' with X, as if you were a shell
 
-    return "".join(result)
+        >>> unescape_backslashes(r'a\ b\\c')
+        'a b\\c'
+        >>> unescape_backslashes('fred\\')
+        'fred'
+    """
+    return _unescape_backslash_re.sub(r'\1', str)
 
 
 
@@ -1606,26 +1778,31 @@ def unquote_list(lst):
         lst = lst[1:-1]
 
     initial = lst.split(' ')
-    last = None
+    # The (non-empty) pieces of the current item, which we only join up
+    # once we've found all of them
+    parts = [ ]
+    pending = False
 
     for i in initial:
-        if (last is not None):
-            last = last + i
-        else:
-            last = i
-
-        # If last ended in a backslash, round again
-        if (len(last) > 0 and last[-1] == '\\'):
-            last = last[:-1]
+        if i:
+            parts.append(i)
+
+        # If what we have so far ends in a backslash, round again
+        if (parts and parts[-1][-1] == '\\'):
+            parts[-1] = parts[-1][:-1]
+            if not parts[-1]:
+                parts.pop()
+            pending = True
             continue
 
         # Otherwise, dump it, unescaping everything else
         # as we do so
-        result.append(unescape_backslashes(last))
-        last = None
+        result.append(unescape_backslashes(''.join(parts)))
+        parts = [ ]
+        pending = False
 
-    if (last is not None):
-        result.append(unescape_backslashes(last))
+    if pending:
+        result.append(unescape_backslashes(''.join(parts)))
 
     return result
 
@@ -1635,53 +1812,77 @@ def find_by_predicate(source_dir, accept_fn, links_are_symbolic = True):
      fn(source_base, file_name) -> result
 
     Obtain a list of [result] if result is not None.
+
+    The results are in the order we walk the tree, depth first - so the
+    results for a sub-directory's contents come straight after those for
+    the sub-directory itself.
     """
 
     result = [ ]
 
+    # We walk the tree iteratively, rather than recursing, but visit things
+    # in the same (depth first) order as the recursive version did. Each
+    # directory we're part way through is remembered as (path, entries),
+    # where 'entries' is an iterator over what _dir_entries() returns.
+    #
+    # Note that (as always) a sub-directory is passed to accept_fn both as
+    # an entry in its parent directory, and as a directory in its own right.
     r = accept_fn(source_dir)
     if (r is not None):
         result.append(r)
 
-
-    if (links_are_symbolic and os.path.islink(source_dir)):
-        # Bah
+    is_link, is_dir = _link_and_dir(source_dir)
+    if (links_are_symbolic and is_link) or not is_dir:
         return result
 
-    if (os.path.isdir(source_dir)):
-        # We may need to recurse...
-        names = os.listdir(source_dir)
-
-        for name in names:
-            full_name = os.path.join(source_dir, name)
+    pending = [(source_dir, _dir_entries(source_dir))]
+    while pending:
+        this_dir, entries = pending[-1]
+        for name, entry_is_link, entry_is_dir in entries:
+            full_name = os.path.join(this_dir, name)
             r = accept_fn(full_name)
             if (r is not None):
                 result.append(r)
 
-            # os.listdir() doesn't return . and ..
-            if (os.path.isdir(full_name)):
-                result.extend(find_by_predicate(full_name, accept_fn, links_are_symbolic))
+            if (entry_is_dir):
+                # Look inside it before carrying on with this directory
+                r = accept_fn(full_name)
+                if (r is not None):
+                    result.append(r)
+                if not (links_are_symbolic and entry_is_link):
+                    pending.append((full_name, _dir_entries(full_name)))
+                    break
+        else:
+            pending.pop()
 
     return result
 
 class MuddleSortedDict(MutableMapping):
     """
     A simple dictionary-like class that returns keys in sorted order.
+
+    The keys are kept in a sorted list as they are added, so iterating
+    over the dictionary doesn't need to sort them each time.
     """
     def __init__(self):
-        self._keys = set()
+        self._keys = []
         self._dict = {}
 
     def __setitem__(self, key, value):
+        if key not in self._dict:
+            bisect.insort_right(self._keys, key)
         self._dict[key] = value
-        self._keys.add(key)
 
     def __getitem__(self, key):
         return self._dict[key]
 
     def __delitem__(self, key):
         del self._dict[key]
-        self._keys.discard(key)
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+        else:
+            self._keys.remove(key)
 
     def __len__(self):
         return len(self._keys)
@@ -1690,9 +1891,7 @@ class MuddleSortedDict(MutableMapping):
         return key in self._dict
 
     def __iter__(self):
-        keys = list(self._keys)
-        keys.sort()
-        return iter(keys)
+        return iter(self._keys)
 
 class MuddleOrderedDict(MutableMapping):
     """
@@ -1726,11 +1925,18 @@ class MuddleOrderedDict(MutableMapping):
 
 def calc_file_hash(filename):
     """Calculate and return the SHA1 hash for the named file.
+
+    Since we want the hash of the whole file, we don't need to go through
+    HashFile line by line - we can just feed it to SHA1 in large chunks.
     """
-    with HashFile(filename) as fd:
-        for line in fd:
-            pass
-    return fd.hash()
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024*1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# How much text HashFile.write() saves up before writing it out
+HASHFILE_WRITE_BUFFER_SIZE = 256*1024
 
 class HashFile(object):
     """
@@ -1770,6 +1976,17 @@ class HashFile(object):
         self.ignore_blank_lines = ignore_blank_lines
         self.fd = open(name, mode)
         self.sha = hashlib.sha1()
+        # When writing, we save up text (and the text we want to hash) and
+        # write/hash it in large chunks, rather than line by line
+        self._write_buffer = []
+        self._hash_buffer = []
+        self._buffered_len = 0
+        # Our mode can't change, so decide now which operations are not
+        # allowed, rather than checking every time we read or write a line
+        if mode == 'r':
+            self.write = self._cannot_write
+        else:
+            self.readline = self._cannot_read
 
     def _add_to_hash(self, text):
         """Should we add this line of text to our hash calculation?
@@ -1793,12 +2010,35 @@ class HashFile(object):
         As is normal for file writes, the '\n' at the end of a line must be
         specified.
         """
-        if self.mode != 'w':
-            raise MuddleBug("Cannot write to HashFile '%s', opened for read"%self.name)
-        self.fd.write(text)
+        self._write_buffer.append(text)
+        self._buffered_len += len(text)
 
         if self._add_to_hash(text):
-            self.sha.update(text)
+            self._hash_buffer.append(text)
+
+        if self._buffered_len >= HASHFILE_WRITE_BUFFER_SIZE:
+            self._flush_buffers()
+
+    def _cannot_write(self, text):
+        """Replaces 'write' when we are opened for read.
+        """
+        raise MuddleBug("Cannot write to HashFile '%s', opened for read"%self.name)
+
+    def _cannot_read(self):
+        """Replaces 'readline' when we are opened for write.
+        """
+        raise MuddleBug("Cannot read from HashFile '%s', opened for write"%self.name)
+
+    def _flush_buffers(self):
+        """Write out (and hash) any text we have saved up.
+        """
+        if self._write_buffer:
+            self.fd.write(''.join(self._write_buffer))
+            self._write_buffer = []
+        if self._hash_buffer:
+            self.sha.update(''.join(self._hash_buffer))
+            self._hash_buffer = []
+        self._buffered_len = 0
 
     def readline(self):
         """
@@ -1806,8 +2046,6 @@ class HashFile(object):
 
         Returns '' if there is no next line (i.e., EOF is reached).
         """
-        if self.mode != 'r':
-            raise MuddleBug("Cannot read from HashFile '%s', opened for write"%self.name)
         text = self.fd.readline()
 
         if text == '':
@@ -1821,12 +2059,14 @@ class HashFile(object):
         """
         Return the SHA1 hash, calculated from the lines so far, as a hex string.
         """
+        self._flush_buffers()
         return self.sha.hexdigest()
 
     def close(self):
         """
         Close the file.
         """
+        self._flush_buffers()
         self.fd.close()
 
     # Support for "with"
@@ -1857,10 +2097,22 @@ class HashFile(object):
         else:
             return text
 
+@functools.total_ordering
 class VersionNumber(object):
     """Simple support for two part "semantic version" numbers.
 
     Such version numbers are of the form <major>.<minor>
+
+    They compare by major number, and then by minor number:
+
+        >>> VersionNumber(1, 5) < VersionNumber(2, 0)
+        True
+        >>> VersionNumber(2, 0) < VersionNumber(1, 5)
+        False
+        >>> VersionNumber(2, 0) > VersionNumber(1, 5)
+        True
+        >>> VersionNumber.unset() < VersionNumber(0, 0)
+        True
     """
 
     def __init__(self, major=0, minor=0):
@@ -1888,19 +2140,13 @@ class VersionNumber(object):
             return 'VersionNumber(%d, %d)'%(self.major, self.minor)
 
     def __eq__(self, other):
-        return (self.major == other.major and
-                self.minor == other.minor)
+        return (self.major, self.minor) == (other.major, other.minor)
 
-    def __lt__(self, other):
-        if self.major < other.major:
-            return True
-        if self.minor < other.minor:
-            return True
-        return False
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-    __gt__ = lambda self, other: not (self < other or self == other)
-    __le__ = lambda self, other: self < other or self == other
-    __ge__ = lambda self, other: not self < other
+    def __lt__(self, other):
+        return (self.major, self.minor) < (other.major, other.minor)
 
     def next(self):
         """Return the next (minor) version number.
@@ -17,7 +17,7 @@ Usage:
 
 Where <switches> are:
 
-  -t[red]           The intermediate dot file will be piped through 'tred',
+  -t[red]           The dot output will be piped through 'tred',
                     which performs transitive reduction of the graph. See ``man
                     tred`` for more information. This is recommended for many
                     muddle dependency trees.
@@ -25,12 +25,12 @@ Where <switches> are:
   -f[ilter] <name>  Tell xdot.py to use the named graphviz filter (one of
                     dot, neato, twopi, circo or fdp). The default is dot.
 
-  -v[erbose]        The programs being run and the names of the intermediate
-                    dot files will be shown.
+  -v[erbose]        The programs being run and the name of the intermediate
+                    dot file will be shown.
 
-  -k[eep]           Keep the intermediate dot file(s). If you specify this
+  -k[eep]           Keep the intermediate dot file. If you specify this
                     it's probably also worth using -verbose so you know what
-                    they are called.
+                    it is called.
 
   -o[utput] <filename>
                     Output to the named file, instead of putting up a
@@ -51,49 +51,55 @@ def process(labels, reduce=False, filter='dot', keep_files=False,
     thisdir = os.path.split(__file__)[0]
     visualiser = os.path.join(thisdir, 'visualise-dependencies.py')
 
-    dotfile_path1 = None
-    dotfile_path2 = None
+    tred = 'tred'
+    dotfile_path = None
 
     try:
-        fd, dotfile_path1 = mkstemp(suffix='.dot', prefix='visdep_', text=True)
+        fd, dotfile_path = mkstemp(suffix='.dot', prefix='visdep_', text=True)
+        if verbose:
+            print 'Running', visualiser, 'for', ' '.join(labels)
+            if reduce:
+                print 'Piping its output through', tred
+            print 'Output dot file is', dotfile_path
+
+        # We don't go via the shell, so there's no need to quote the
+        # labels (which may contain parentheses)
         try:
-            if verbose:
-                print 'Running', visualiser, 'for', ' '.join(labels)
-                print 'Outut dot file is', dotfile_path1
-            # Labels may contain parentheses
-            labels2 = []
-            for label in labels:
-                labels2.append("'%s'"%label)
-            retcode = subprocess.call('%s %s'%(visualiser, ' '.join(labels2)),
-                                      stdout=fd, shell=True)
-            if retcode != 0:
-                print 'Error %d running %s'%(abs(retcode), visualiser)
-                return
+            if reduce:
+                # Run tred on the visualiser output as it is produced,
+                # rather than waiting for it to be written to a file first.
+                # We assume that tred is on our PATH
+                vis = subprocess.Popen([visualiser] + labels,
+                                       stdout=subprocess.PIPE, close_fds=True)
+            else:
+                vis = subprocess.Popen([visualiser] + labels,
+                                       stdout=fd, close_fds=True)
         except OSError as e:
             print 'Error running %s: %s'%(visualiser, e)
             return
 
-        os.close(fd)
-
-        # We assume that xdot.py is on our PATH
         if reduce:
-            tred = 'tred'
-            fd2, dotfile_path2 = mkstemp(suffix='.dot', prefix='visdep_', text=True)
             try:
-                if verbose:
-                    print 'Running', tred
-                    print 'Output dot file is', dotfile_path2
-                retcode = subprocess.call('%s %s'%(tred, dotfile_path1), stdout=fd2, shell=True)
-                if retcode != 0:
-                    print 'Error %d running %s'%(abs(retcode), tred)
-                    return
+                red = subprocess.Popen([tred], stdin=vis.stdout,
+                                       stdout=fd, close_fds=True)
             except OSError as e:
                 print 'Error running %s: %s'%(tred, e)
+                vis.kill()
+                vis.wait()
                 return
-            os.close(fd2)
-            dotfile_path = dotfile_path2
-        else:
-            dotfile_path = dotfile_path1
+            # So that the visualiser gets SIGPIPE if tred exits early
+            vis.stdout.close()
+            red_retcode = red.wait()
+
+        retcode = vis.wait()
+        os.close(fd)
+
+        if retcode != 0:
+            print 'Error %d running %s'%(abs(retcode), visualiser)
+            return
+        if reduce and red_retcode != 0:
+            print 'Error %d running %s'%(abs(red_retcode), tred)
+            return
 
         if outputfile:
             try:
@@ -102,8 +108,9 @@ def process(labels, reduce=False, filter='dot', keep_files=False,
                 filetype = filetype[1:]
                 if verbose:
                     print 'Outputting to', outputfile
-                retcode = subprocess.call('dot -o%s -T%s %s'%(outputfile, filetype,
-                    dotfile_path), shell=True)
+                retcode = subprocess.call(['dot', '-o%s'%outputfile,
+                                           '-T%s'%filetype, dotfile_path],
+                                          close_fds=True)
                 if retcode != 0:
                     print 'Error %d running dot to output file'%(abs(retcode))
                     return
@@ -111,11 +118,13 @@ def process(labels, reduce=False, filter='dot', keep_files=False,
                 print 'Error running dot to output file: %s'%(e)
                 return
         else:
+            # We assume that xdot is on our PATH
             xdot = 'xdot'
             try:
                 if verbose:
                     print 'Running', xdot
-                retcode = subprocess.call('%s --filter=%s %s'%(xdot, filter, dotfile_path), shell=True)
+                retcode = subprocess.call([xdot, '--filter=%s'%filter, dotfile_path],
+                                          close_fds=True)
                 if retcode != 0:
                     print 'Error %d running %s'%(abs(retcode), xdot)
                     return
@@ -123,11 +132,8 @@ def process(labels, reduce=False, filter='dot', keep_files=False,
                 print 'Error running %s: %s'%(xdot, e)
                 return
     finally:
-        if not keep_files:
-            if dotfile_path1:
-                os.remove(dotfile_path1)
-            if dotfile_path2:
-                os.remove(dotfile_path2)
+        if not keep_files and dotfile_path:
+            os.remove(dotfile_path)
 
 def main(args):
 
@@ -10,6 +10,11 @@ are slower).
 With argument -ignore <test>, ignore the test script <script>.
 
 With argument -list, lists the tests it would have run.
+
+Each test script is run with the same Python as this script, so (for
+instance) "pypy all_tests.py" runs the tests under PyPy. Note that the
+muddle commands the tests invoke still use the Python named in their
+"#!" line.
 """
 
 import os
@@ -88,7 +93,7 @@ def run_tests(args):
         print '======== %s ========'%name
         print
         try:
-            shell('./%s'%name)
+            shell([sys.executable, name])
         except ShellError as e:
             raise GiveUp('Test %s failed with return code %d'%(name, e.retcode))
         print
@@ -6,6 +6,7 @@ For once, intended to be safe for use with ``from support_for_tests import *``
 """
 
 import os
+import re
 import shutil
 import subprocess
 import sys
@@ -14,7 +15,8 @@ import stat
 import string
 
 from difflib import unified_diff, ndiff
-from fnmatch import fnmatchcase
+from fnmatch import translate
+from itertools import islice
 from StringIO import StringIO
 
 __all__ = []
@@ -107,15 +109,23 @@ def run_muddle_directly(args, verbose=True):
             os.environ['PWD'] = old_pwd
 
 @export
-def muddle(args, verbose=True):
+def muddle(args, verbose=True, cwd=None):
     """Run a muddle command
+
+    If 'cwd' is given, run it in that directory, rather than the current one.
     """
     if verbose:
         flushing_print('++ muddle %s\n'%(' '.join(args)))
     cmd_seq = [MUDDLE_BINARY] + args
     if verbose:
         flushing_print(">> muddle %s\n"%(' '.join(args)))
-    p = subprocess.Popen(cmd_seq)
+    if cwd is None:
+        p = subprocess.Popen(cmd_seq)
+    else:
+        # Muddle believes PWD in preference to its actual directory
+        env = os.environ.copy()
+        env['PWD'] = cwd
+        p = subprocess.Popen(cmd_seq, cwd=cwd, env=env)
     pid, retcode = os.waitpid(p.pid, 0)
     if retcode:
         raise ShellError(' '.join(cmd_seq), retcode)
@@ -182,10 +192,12 @@ def captured_muddle2(args, verbose=True):
         return e.returncode, e.output
 
 @export
-def git(cmd):
+def git(cmd, cwd=None):
     """Run a git command
+
+    If 'cwd' is given, run it in that directory, rather than the current one.
     """
-    shell('%s %s'%('git',cmd))
+    shell('%s %s'%('git',cmd), cwd=cwd)
 
 @export
 def bzr(cmd):
@@ -242,17 +254,24 @@ def same_content(filename, content=None, verbose=True):
 @export
 def check_files(paths, verbose=True):
     """Given a list of paths, check they all exist.
+
+    If 'verbose', the paths are reported all together once we've checked
+    them (or found one that is missing), rather than flushing out one line
+    for each.
     """
-    if verbose:
-        flushing_print('++ Checking files exist\n')
+    found = []
+    missing = None
     for name in paths:
         if os.path.exists(name):
-            if verbose:
-                flushing_print('  -- %s\n'%name)
+            found.append('  -- %s\n'%name)
         else:
-            raise GiveUp('File %s does not exist'%name)
+            missing = name
+            break
     if verbose:
-        flushing_print('++ All named files exist\n')
+        flushing_print('++ Checking files exist\n%s%s'%(''.join(found),
+                       '' if missing else '++ All named files exist\n'))
+    if missing:
+        raise GiveUp('File %s does not exist'%missing)
 
 @export
 def check_specific_files_in_this_dir(names, verbose=True):
@@ -406,6 +425,34 @@ def check_text_endswith(text, should_end_with):
     if not text.endswith(should_end_with):
         check_text(text, should_end_with)  # which we thus know will fail
 
+# Compiled matchers for lists of unwanted files, see _unwanted_matcher()
+gUnwantedMatchers = {}
+
+def _unwanted_matcher(unwanted_files):
+    """Return a function that matches any of the fnmatch 'unwanted_files'.
+
+    The function is the 'match' method of a single regular expression for all
+    of the expressions, so it returns None for a path that matches none of
+    them. Since we tend to use the same lists over and over again, the
+    results are cached.
+
+    >>> match = _unwanted_matcher(['*/.git*', '*/*.c'])
+    >>> [bool(match(p)) for p in ('a/.gitignore', 'a/b.c', 'a/b.h', 'b.c')]
+    [True, True, False, False]
+    >>> match is _unwanted_matcher(['*/.git*', '*/*.c'])
+    True
+    """
+    key = tuple(unwanted_files)
+    try:
+        return gUnwantedMatchers[key]
+    except KeyError:
+        pass
+    # An empty alternation would match everything, so use one that never does
+    parts = ['(?:%s)'%translate(expr) for expr in key] or ['(?!)']
+    match = re.compile('|'.join(parts)).match
+    gUnwantedMatchers[key] = match
+    return match
+
 @export
 class DirTree(object):
     """A tool for representing a directory tree in ASCII.
@@ -432,13 +479,59 @@ class DirTree(object):
         to its container. Two spaces normally makes a good default.
         """
         self.path = path
+        # We check every directory we meet against this, so make it a set
         if fold_dirs:
-            self.fold_dirs = fold_dirs[:]
+            self.fold_dirs = frozenset(fold_dirs)
         else:
-            self.fold_dirs = []
+            self.fold_dirs = frozenset()
         self.indent = indent
+        self._entries = None
 
-    def _filestr(self, path, filename):
+    def snapshot(self):
+        """Remember the current state of our directory tree, and return self.
+
+        After this, 'as_lines()' (and thus 'assert_same()') report the tree
+        as it was when we were called, without looking at the filesystem
+        again. This is useful when we are going to compare the same
+        (unchanging) tree against many others.
+        """
+        entries = []
+        if os.path.exists(self.path):
+            head, tail = os.path.split(self.path)
+            self._walk(self.path, tail, entries, 0)
+        self._entries = tuple(entries)
+        return self
+
+    def _walk(self, path, tail, entries, level):
+        """Add (path, level, representation) for 'path' and its contents.
+        """
+        mode = os.stat(path).st_mode
+        entries.append((path, level, self._filestr(path, tail, mode)))
+        if stat.S_ISDIR(mode) and tail not in self.fold_dirs:
+            files = os.listdir(path)
+            files.sort()
+            for name in files:
+                self._walk(os.path.join(path, name), name, entries, level+1)
+
+    def _snapshot_lines(self, onedown, unwanted):
+        """Generate the lines for 'iter_lines()', from our snapshot.
+
+        'unwanted' is as for '_tree()'.
+        """
+        indent = self.indent
+        skip_below = None
+        for path, level, text in self._entries:
+            if skip_below is not None:
+                if level > skip_below:
+                    continue
+                skip_below = None
+            if unwanted(path):
+                skip_below = level
+                continue
+            if level or not onedown:
+                yield '%s%s'%(level*indent, text)
+
+    def _filestr(self, path, filename, m):
         """Return a useful representation of a file.
 
         'path' is the full path of the file, sufficient to "find" it with
@@ -449,9 +542,11 @@ class DirTree(object):
 
         We could work the latter out from the former, but our caller already
         knew both, so this is hopefully slightly faster.
+
+        'm' is the file's mode, from os.stat(). Our caller also needs that,
+        to decide whether to look inside the file, so it passes it on rather
+        than have us stat the file again.
         """
-        s = os.stat(path)
-        m = s.st_mode
         flags = []
         if stat.S_ISLNK(m):
             # This is *not* going to show the identical linked path as
@@ -475,37 +570,65 @@ class DirTree(object):
         return '%s%s'%(filename, ''.join(flags))
 
     def path_is_wanted(self, path, unwanted_files):
-        for expr in unwanted_files:
-            if fnmatchcase(path, expr):
-                return False
-        return True
+        return _unwanted_matcher(unwanted_files)(path) is None
 
-    def _tree(self, path, head, tail, unwanted_files, lines, level, report_this=True):
-        """Add the next components of the tree to 'lines'
+    def _tree(self, path, tail, unwanted, level, report_this=True):
+        """Generate the next components of the tree.
 
-        First adds the element specified by 'path' (or 'head'/'tail'),
-        and then recurses down inside it if that is a directory that
-        we are reporting on (depending on self.fold_dirs).
+        First yields the element specified by 'path', and then recurses down
+        inside it if that is a directory that we are reporting on (depending
+        on self.fold_dirs).
 
-        'lines' is our accumulator of results. 'level' indicates how
-        much indentation we're currently using, at this level.
+        'level' indicates how much indentation we're currently using, at
+        this level.
 
-        'path' is the same as 'head' joined to 'tail' - they're passed
-        down separately just because we already had to calculate 'head'
-        and 'tail' higher up, but we need all three.
+        'tail' is the last component of 'path' - it's passed down separately
+        just because we already had to calculate it higher up.
 
-        See the description of 'same_as' for how 'unwanted_files' is
-        interpreted.
+        'unwanted' is a function, as returned by _unwanted_matcher(), that
+        matches the paths we don't want. See the description of 'same_as' for
+        how the unwanted files are specified.
         """
+        mode = os.stat(path).st_mode
         if report_this:
-            lines.append('%s%s'%(level*self.indent, self._filestr(path, tail)))
-        if os.path.isdir(path) and tail not in self.fold_dirs:
+            yield '%s%s'%(level*self.indent, self._filestr(path, tail, mode))
+        if stat.S_ISDIR(mode) and tail not in self.fold_dirs:
             files = os.listdir(path)
             files.sort()
             for name in files:
                 this_path = os.path.join(path, name)
-                if self.path_is_wanted(this_path, unwanted_files):
-                    self._tree(this_path, path, name, unwanted_files, lines, level+1)
+                if not unwanted(this_path):
+                    for line in self._tree(this_path, name, unwanted, level+1):
+                        yield line
+
+    def iter_lines(self, onedown=False, unwanted_files=None):
+        """Generate our representation, one text line at a time.
+
+        This is 'as_lines()' without building the list, so that a caller
+        that is going to stop at the first difference need not walk the rest
+        of the tree.
+        """
+        if self._entries is None and not os.path.exists(self.path):
+            return
+
+        if unwanted_files is None:
+            unwanted_files = []
+        # Turn our unwanted path fragments into fnmatch expressions, and
+        # those into a single regular expression - we do this once here
+        # because we expect to do lots of comparisons
+        unwanted = _unwanted_matcher(['*/%s'%expr for expr in unwanted_files])
+
+        if self._entries is not None:
+            lines = self._snapshot_lines(onedown, unwanted)
+        elif not unwanted(self.path):
+            # Start with 'self.path' itself
+            head, tail = os.path.split(self.path)
+            lines = self._tree(self.path, tail, unwanted, 0,
+                               report_this=not onedown)
+        else:
+            return
+        for line in lines:
+            yield line
 
     def as_lines(self, onedown=False, unwanted_files=None):
         """Return our representation as a list of text lines.
@@ -518,26 +641,7 @@ class DirTree(object):
 
         Our "str()" output is this list joined with newlines.
         """
-        lines = []
-        if not os.path.exists(self.path):
-            return lines
-
-        if unwanted_files is None:
-            unwanted_files = []
-        else:
-            # Turn our unwanted path fragments into fnmatch expressions
-            # - we do this one here because we expect to do lots of comparisons
-            actual_unwanted_files = []
-            for expr in unwanted_files:
-                actual_unwanted_files.append('*/%s'%expr)
-            unwanted_files = actual_unwanted_files
-
-        # Start with 'self.path' itself
-        head, tail = os.path.split(self.path)
-        if self.path_is_wanted(self.path, unwanted_files):
-            self._tree(self.path, head, tail, unwanted_files, lines, 0,
-                       report_this=not onedown)
-        return lines
+        return list(self.iter_lines(onedown, unwanted_files))
 
     def __str__(self):
         lines = self.as_lines()
@@ -600,7 +704,15 @@ class DirTree(object):
         """
         other = DirTree(other_path, self.fold_dirs, self.indent)
         this_lines = self.as_lines(onedown, unwanted_files)
-        that_lines = other.as_lines(onedown)
+        if this_lines and not os.path.exists(other.path):
+            # Typically the command that should have made it failed, so
+            # there's no point listing everything it should have contained
+            raise GiveUp('Directory tree mismatch\n'
+                         '--- {us}\n'
+                         '+++ {them}\n'
+                         '{them} does not exist'.format(us=self.path,
+                                                       them=other.path))
+        that_lines = other.iter_lines(onedown)
 
         self._same_as(this_lines, that_lines, other.path,
                       unwanted_files=None, unwanted_extensions=None)
@@ -609,13 +721,24 @@ class DirTree(object):
     def _same_as(self, this_lines, that_lines, that_path,
                  unwanted_files=None, unwanted_extensions=None):
         """ The internals of our comparison. See 'same_as()' for details.
+
+        'this_lines' must be a list, but 'that_lines' may be any iterable
+        (typically from 'iter_lines()'), and we stop reading it as soon as
+        we know the two differ.
         """
         if unwanted_files:
             unwanted_text = 'Unwanted files:\n  %s\n'%('\n  '.join(unwanted_files))
         else:
             unwanted_text = ''
 
-        for index, (this, that) in enumerate(zip(this_lines, that_lines)):
+        that_iter = iter(that_lines)
+        for index, this in enumerate(this_lines):
+            try:
+                that = next(that_iter)
+            except StopIteration:
+                # 'that' has run out before 'this'
+                self._different_lengths(this_lines, index, this_lines[index:],
+                                        self.path, that_path, unwanted_text)
             if this != that:
                 context_lines = []
                 for n in range(index):
@@ -635,46 +758,49 @@ class DirTree(object):
                                      unwanted=unwanted_text, context=context,
                                      index=index, this=this, that=that))
 
-        if len(this_lines) != len(that_lines):
-            len_this = len(this_lines)
-            len_that = len(that_lines)
-            same = min(len_this, len_that)
-            context_lines = []
-            for n in range(same):
-                context_lines.append(' %s'%(this_lines[n]))
-
-            if len_this > len_that:
-                difference = len_this - len_that
-                context_lines.append('...and then %d more line%s in %s'%(difference,
-                    '' if difference==1 else 's', self.path))
-                for count in range(min(3, difference)):
-                    context_lines.append('-%s'%(this_lines[len_that+count]))
-                if difference > 4:
-                    context_lines.append('...etc.')
-                elif difference == 4:
-                    context_lines.append('-%s'%(this_lines[len_that+3]))
-            else:
-                difference = len_that - len_this
-                context_lines.append('...and then %d more line%s in %s'%(difference,
-                    '' if difference==1 else 's', that_path))
-                for count in range(min(3, difference)):
-                    context_lines.append('-%s'%(that_lines[len_this+count]))
-                if difference > 4:
-                    context_lines.append('...etc.')
-                elif difference == 4:
-                    context_lines.append('-%s'%(that_lines[len_this+3]))
-
-            context = '\n'.join(context_lines)
-
-            raise GiveUp('Directory tree mismatch\n'
-                         '{unwanted}'
-                         '--- {us}\n'
-                         '+++ {them}\n'
-                         'Different number of lines ({uslen} versus {themlen})\n'
-                         '{context}'.format(us=self.path, them=that_path,
-                             unwanted=unwanted_text,
-                             uslen=len(this_lines), themlen=len(that_lines),
-                             context=context))
+        # 'that' may still have lines left. We only want to show the first
+        # few of them, but we need to count them all
+        extra = list(islice(that_iter, 4))
+        if extra:
+            extra.extend(that_iter)
+            self._different_lengths(this_lines, len(this_lines) + len(extra),
+                                    extra, that_path, that_path, unwanted_text)
+
+    def _different_lengths(self, this_lines, len_that, extra, longer_path,
+                           that_path, unwanted_text):
+        """Report that our lines and the other lines have different lengths.
+
+        'this_lines' is our list of lines, and 'len_that' is how many lines
+        the other has. The two agree as far as the shorter of them goes, and
+        'extra' is the lines left over in the longer, which is 'longer_path'.
+        """
+        len_this = len(this_lines)
+        same = min(len_this, len_that)
+        context_lines = []
+        for n in range(same):
+            context_lines.append(' %s'%(this_lines[n]))
+
+        difference = len(extra)
+        context_lines.append('...and then %d more line%s in %s'%(difference,
+            '' if difference==1 else 's', longer_path))
+        for count in range(min(3, difference)):
+            context_lines.append('-%s'%(extra[count]))
+        if difference > 4:
+            context_lines.append('...etc.')
+        elif difference == 4:
+            context_lines.append('-%s'%(extra[3]))
+
+        context = '\n'.join(context_lines)
+
+        raise GiveUp('Directory tree mismatch\n'
+                     '{unwanted}'
+                     '--- {us}\n'
+                     '+++ {them}\n'
+                     'Different number of lines ({uslen} versus {themlen})\n'
+                     '{context}'.format(us=self.path, them=that_path,
+                         unwanted=unwanted_text,
+                         uslen=len_this, themlen=len_that,
+                         context=context))
 
     def assert_same_as_list(self, path_list, other_path, onedown=False,
                             unwanted_files=None, unwanted_extensions=None):
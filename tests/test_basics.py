@@ -1,11 +1,18 @@
 #! /usr/bin/env python
 """
 Tests the rest of muddled.
+
+    test_basics.py [<test_name> ...]
+
+With no arguments, runs all of the tests. Otherwise, just runs the named
+tests (for instance, ``filespec_unit_test``).
 """
 
+from __future__ import print_function
+
+import io
 import os
 import sys
-import subprocess
 import traceback
 
 from support_for_tests import get_parent_dir
@@ -31,13 +38,9 @@ from muddled.depend import Label
 
 def cpio_unit_test():
     """
-    A brief test of the cpio module. Uses ``<tempname>/test.cpio``.
+    A brief test of the cpio module. The archive is rendered in memory.
     """
 
-    tmpd = os.tempnam()
-    os.mkdir(tmpd)
-    tmpf = os.path.join(tmpd, 'test.cpio')
-
     f1 = cpiofile.file_from_fs(__file__)  # A file we're fairly sure exists
     f1.rename("foo")
     f2 = cpiofile.file_for_dir("bar")
@@ -46,15 +49,20 @@ def cpio_unit_test():
     f3.set_contents("Hello, World!\n")
 
     arc = cpiofile.Archive()
-    arc.add_files([f1])
-    arc.render(tmpf, True)
-    # Now just make sure that cpio can read the data
+    arc.add_files([f1, f2, f3])
+    buf = io.BytesIO()
+    arc.render(buf, True)
 
-    out = subprocess.check_output("cpio -i --to-stdout <'%s'"%tmpf, shell=True)
+    # Now just make sure that we can read the data back
+    buf.seek(0)
+    arc2 = cpiofile.Archive.load(buf)
+
+    assert [f.name for f in arc2.files] == ["foo", "bar", "bar/baz"]
 
     text = open(__file__).read()
-    assert out[:len(text)] == text
-    # Ignoring any extra lines about number of blocks...
+    assert arc2.files[0].data == text
+    assert arc2.files[1].mode == f2.mode
+    assert arc2.files[2].data == "Hello, World!\n"
 
 def env_store_unit_test():
     """
@@ -116,31 +124,24 @@ def filespec_unit_test():
     assert len(l_part) == 2
 
     # Right ..
-    fs1 = filespec.FileSpec("/a", ".*", False, False)
-    results = fs1.match(lsp)
-    assert len(results) == 2
-    assert "/a/b" in results
-    assert "/a/c" in results
-
-    fs1 = filespec.FileSpec("/a", "b", allUnder = False, allRegex = False)
-    results = fs1.match(lsp)
-    assert len(results) == 1
-    assert "/a/b" in results
-
-    fs1 = filespec.FileSpec("/a", "b", allUnder = True, allRegex = False)
-    results = fs1.match(lsp)
-    assert len(results) == 3
-    assert "/a/b/c" in results
-    assert "/a/b/cee" in results
-    assert "/a/b" in results
-
-    fs1 = filespec.FileSpec("/", "(.*)b(.*)", allUnder = True, allRegex = True)
-    results = fs1.match(lsp)
-    assert len(results) == 4
-    assert "/d/bcee" in results
-    assert "/a/b/c" in results
-    assert "/a/b/cee" in results
-    assert "/a/b" in results
+    # Each case is (root, spec, allUnder, allRegex, expected results)
+    cases = [
+        ("/a", ".*", False, False, ["/a/b", "/a/c"]),
+        ("/a", "b", False, False, ["/a/b"]),
+        ("/a", "b", True, False, ["/a/b", "/a/b/c", "/a/b/cee"]),
+        ("/", "(.*)b(.*)", True, True, ["/a/b", "/a/b/c", "/a/b/cee", "/d/bcee"]),
+        ]
+
+    for root, spec, all_under, all_regex, expected in cases:
+        fs1 = filespec.FileSpec(root, spec, allUnder = all_under, allRegex = all_regex)
+        results = fs1.match(lsp)
+        assert sorted(results) == expected, \
+                'FileSpec(%r, %r, %s, %s) matched %s'%(root, spec, all_under,
+                                                       all_regex, sorted(results))
+
+    # FileSpecs with the same spec share the same compiled regex
+    assert (filespec.FileSpec("/a", "b").spec_re is
+            filespec.FileSpec("/d", "b", allUnder = True).spec_re)
 
 
 def depend_unit_test():
@@ -385,10 +386,10 @@ def label_domain_sort():
 
     l1 = Label.from_string("checkout:(subdomain2(subdomain3))main_co/checked_out")
     l2 = Label.from_string("checkout:first_co/checked_out")
-    print
-    print 'xx', l1
-    print 'xx', l2
-    print 'xx l2 < l1', l2 < l1
+    print()
+    print('xx', l1)
+    print('xx', l2)
+    print('xx l2 < l1', l2 < l1)
     assert l2 < l1
 
     labels = [
@@ -445,30 +446,43 @@ def label_domain_sort():
              " checkout:(subdomain2(subdomain4))second_co/checked_out"
             )
 
-def run_tests():
-    print "> cpio"
-    cpio_unit_test()
-    print "> Utils"
-    utils_unit_test()
-    print "> env"
-    env_store_unit_test()
-    print "> subst"
-    subst_unit_test()
-    print "> filespec"
-    filespec_unit_test()
-    print "> VCS"
-    vcs_unit_test()
-    print "> Depends"
-    depend_unit_test()
-    print "> Label domain sort"
-    label_domain_sort()
+# The tests, in the order we run them. None of them depend on any of the
+# others, so they can also be run singly or in any order.
+TESTS = [
+    ("cpio", cpio_unit_test),
+    ("Utils", utils_unit_test),
+    ("env", env_store_unit_test),
+    ("subst", subst_unit_test),
+    ("filespec", filespec_unit_test),
+    ("VCS", vcs_unit_test),
+    ("Depends", depend_unit_test),
+    ("Label domain sort", label_domain_sort),
+    ]
+
+def run_tests(names=None):
+    """
+    Run the tests whose function names are in 'names', or all of them.
+    """
+    for description, test in TESTS:
+        if names and test.__name__ not in names:
+            continue
+        print("> %s"%description)
+        test()
 
 if __name__ == '__main__':
+    args = sys.argv[1:]
+    unknown = set(args) - set(test.__name__ for description, test in TESTS)
+    if unknown:
+        print('Unknown test%s: %s'%('' if len(unknown) == 1 else 's',
+                                    ', '.join(sorted(unknown))))
+        print('Available tests are: %s'%', '.join(test.__name__
+                                                  for description, test in TESTS))
+        sys.exit(1)
     try:
-        run_tests()
-        print '\nGREEN light\n'
+        run_tests(args)
+        print('\nGREEN light\n')
     except Exception as e:
-        print
+        print()
         traceback.print_exc()
-        print '\nRED light\n'
+        print('\nRED light\n')
         sys.exit(1)
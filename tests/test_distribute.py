@@ -3,7 +3,8 @@
 
     $ ./test_distribute.py [-keep]
 
-With -keep, do not delete the 'transient' directory used for the tests.
+The tests are run in a new temporary directory (in $TMPDIR, if that is set).
+With -keep, do not delete that directory afterwards.
 
 Our test build structure is::
 
@@ -13,12 +14,17 @@ Our test build structure is::
                 subdomain2
 """
 
+from __future__ import print_function
+
+import multiprocessing
 import os
 import shutil
 import string
 import subprocess
 import sys
+import threading
 import traceback
+from multiprocessing.pool import ThreadPool
 
 from support_for_tests import *
 try:
@@ -28,8 +34,8 @@ except ImportError:
     sys.path.insert(0, get_parent_dir(__file__))
     import muddled.cmdline
 
-from muddled.utils import GiveUp, normalise_dir, LabelType, LabelTag, DirTypeDict
-from muddled.withdir import Directory, NewDirectory, TransientDirectory
+from muddled.utils import GiveUp, ShellError, normalise_dir, LabelType, LabelTag, DirTypeDict
+from muddled.withdir import Directory, TransientDirectory
 from muddled.depend import Label, label_list_to_string
 from muddled.version_stamp import VersionStamp
 
@@ -289,144 +295,733 @@ INSTRUCTIONS = """
 </instructions>
 """
 
-def make_build_desc(co_dir, file_content):
+def git_in(repo_dir, args, input=None):
+    """Run a git command in 'repo_dir', and return its (standard) output.
+
+    'args' is a list of the arguments to git. If 'input' is given, it is
+    written to the command's standard input.
+
+    We use an explicit working directory rather than os.chdir(), so that
+    several repositories can be built at the same time.
+    """
+    sys.stdout.write('> git %s  [in %s]\n'%(' '.join(args), repo_dir))
+    sys.stdout.flush()
+    proc = subprocess.Popen(['git'] + args, cwd=repo_dir,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = proc.communicate(input)
+    if proc.returncode:
+        raise ShellError('git %s'%' '.join(args), proc.returncode, output)
+    return output
+
+def make_git_repo(repo_dir, commits, details=None, alternates=None):
+    """Create a git repository in 'repo_dir', with some commits.
+
+    'commits' is a list of (message, files) tuples, where 'files' is a list
+    of (filename, content) tuples. Each commit adds its files to those
+    committed before it.
+
+    Rather than running "git add" and "git commit" for each commit, we feed
+    them all to a single "git fast-import". The content goes straight from
+    memory into the repository, and since these repositories are only ever
+    cloned from, we don't bother to check it out into a working tree.
+
+    'details' is the (ref, committer) tuple to use for the commits. If it is
+    None, we ask git. Either way, it is returned, so that it can be passed
+    to later calls, which then don't need to ask again.
+
+    If 'alternates' is given, it is the path to another repository's objects
+    directory, which git will look in before storing an object itself - so
+    content that is already there is not written again.
+    """
+    os.makedirs(repo_dir)
+    git_in(repo_dir, ['init', '--quiet'])
+    if alternates:
+        with open(os.path.join(repo_dir, '.git', 'objects', 'info',
+                               'alternates'), 'w') as fd:
+            fd.write('%s\n'%alternates)
+    if details is None:
+        details = (git_in(repo_dir, ['symbolic-ref', 'HEAD']).strip(),
+                   git_in(repo_dir, ['var', 'GIT_COMMITTER_IDENT']).strip())
+    ref, ident = details
+    parts = []
+    for message, files in commits:
+        parts.append('commit %s\ncommitter %s\ndata %d\n%s\n'%(ref, ident,
+                     len(message), message))
+        for filename, content in files:
+            parts.append('M 100644 inline %s\ndata %d\n%s\n'%(filename,
+                         len(content), content))
+    parts.append('done\n')
+
+    git_in(repo_dir, ['fast-import', '--quiet', '--done'], ''.join(parts))
+    return details
+
+def make_build_desc(co_dir, file_content, details=None):
     """Take some of the repetition out of making build descriptions.
+
+    'details' is as for make_git_repo(), which returns it.
+    """
+    return make_git_repo(co_dir, [('Commit build desc', [('01.py', file_content)]),
+                                 ('Commit .gitignore', [('.gitignore', GITIGNORE)])],
+                         details)
+
+# The files for each checkout, by program name, see checkout_files()
+gCheckoutFiles = {}
+
+def checkout_files(progname):
+    """Return the (filename, content) tuples for a checkout of 'progname'.
+
+    Several checkouts share the same program name, so we only fill in the
+    templates once for each.
     """
-    git('init')
-    touch('01.py', file_content)
-    git('add 01.py')
-    git('commit -m "Commit build desc"')
-    touch('.gitignore', GITIGNORE)
-    git('add .gitignore')
-    git('commit -m "Commit .gitignore"')
-
-def make_standard_checkout(co_dir, progname, desc):
+    try:
+        return gCheckoutFiles[progname]
+    except KeyError:
+        pass
+    files = (('{progname}.c'.format(progname=progname),
+              MAIN_C_SRC.format(progname=progname)),
+             ('Makefile.muddle', MUDDLE_MAKEFILE.format(progname=progname)))
+    gCheckoutFiles[progname] = files
+    return files
+
+def make_standard_checkout(co_dir, progname, desc, details=None,
+                           alternates=None):
     """Take some of the repetition out of making checkouts.
+
+    Each checkout is a single commit of its C source and muddle Makefile.
+    'details' and 'alternates' are as for make_git_repo(), which returns
+    'details'.
     """
-    git('init')
-    touch('{progname}.c'.format(progname=progname),
-            MAIN_C_SRC.format(progname=progname))
-    touch('Makefile.muddle', MUDDLE_MAKEFILE.format(progname=progname))
-    git('add {progname}.c Makefile.muddle'.format(progname=progname))
-    git('commit -a -m "Commit {desc} checkout {progname}"'.format(desc=desc,
-        progname=progname))
+    message = 'Commit {desc} checkout {progname}'.format(desc=desc,
+                                                         progname=progname)
+    return make_git_repo(co_dir, [(message, checkout_files(progname))], details,
+                         alternates)
+
+# The program names of the checkouts that every domain has
+SHARED_PROGNAMES = ('first', 'second')
+
+def make_shared_objects(repo_dir):
+    """Store the content of the checkouts every domain shares, just once.
+
+    Creates a bare repository in 'repo_dir', containing (just) the files for
+    each of SHARED_PROGNAMES, and returns the path to its objects directory,
+    for use as 'alternates' by the repositories for those checkouts.
+    """
+    os.makedirs(repo_dir)
+    git_in(repo_dir, ['init', '--quiet', '--bare'])
+    parts = []
+    for progname in SHARED_PROGNAMES:
+        for filename, content in checkout_files(progname):
+            parts.append('blob\ndata %d\n%s\n'%(len(content), content))
+    parts.append('done\n')
+    git_in(repo_dir, ['fast-import', '--quiet', '--done'], ''.join(parts))
+    return os.path.join(repo_dir, 'objects')
+
+def make_domain_repos(domain_dir, build_desc, main_progname, main_desc,
+                      alternates=None):
+    """Create the repositories for one domain, in 'domain_dir'.
+
+    Muddle clones each checkout separately, so each must be a repository
+    of its own, but they can all share the details of how to commit. The
+    checkouts that every domain has get their content from 'alternates', as
+    returned by make_shared_objects().
+    """
+    details = make_build_desc(os.path.join(domain_dir, 'builds'), build_desc)
+    make_standard_checkout(os.path.join(domain_dir, 'main_co'),
+                           main_progname, main_desc, details)
+    for progname in SHARED_PROGNAMES:
+        make_standard_checkout(os.path.join(domain_dir, '%s_co'%progname),
+                               progname, progname, details, alternates)
 
 def make_repos_with_subdomain(root_dir):
     """Create git repositories for our subdomain tests.
+
+    Each domain's repositories are independent of the others, so we build
+    them all at once, each in its own thread. The content they have in
+    common is stored first, in a repository of its own.
     """
     repo = os.path.join(root_dir, 'repo')
-    with NewDirectory('repo'):
-        with NewDirectory('main'):
-            with NewDirectory('builds') as d:
-                make_build_desc(d.where, TOPLEVEL_BUILD_DESC.format(repo=repo))
-            with NewDirectory('main_co') as d:
-                make_standard_checkout(d.where, 'main0', 'main')
-            with NewDirectory('first_co') as d:
-                make_standard_checkout(d.where, 'first', 'first')
-            with NewDirectory('second_co') as d:
-                make_standard_checkout(d.where, 'second', 'second')
-        with NewDirectory('subdomain1'):
-            with NewDirectory('builds') as d:
-                make_build_desc(d.where, SUBDOMAIN1_BUILD_DESC.format(repo=repo))
-            with NewDirectory('main_co') as d:
-                make_standard_checkout(d.where, 'subdomain1', 'subdomain1')
-            with NewDirectory('first_co') as d:
-                make_standard_checkout(d.where, 'first', 'first')
-            with NewDirectory('second_co') as d:
-                make_standard_checkout(d.where, 'second', 'second')
-        with NewDirectory('subdomain2'):
-            with NewDirectory('builds') as d:
-                make_build_desc(d.where, SUBDOMAIN2_BUILD_DESC.format(repo=repo))
-            with NewDirectory('main_co') as d:
-                make_standard_checkout(d.where, 'subdomain2', 'subdomain2')
-            with NewDirectory('first_co') as d:
-                make_standard_checkout(d.where, 'first', 'first')
-            with NewDirectory('second_co') as d:
-                make_standard_checkout(d.where, 'second', 'second')
-        with NewDirectory('subdomain3'):
-            with NewDirectory('builds') as d:
-                make_build_desc(d.where, SUBDOMAIN3_BUILD_DESC)
-            with NewDirectory('main_co') as d:
-                make_standard_checkout(d.where, 'subdomain3', 'subdomain3')
-            with NewDirectory('first_co') as d:
-                make_standard_checkout(d.where, 'first', 'first')
-            with NewDirectory('second_co') as d:
-                make_standard_checkout(d.where, 'second', 'second')
-
-def checkout_build_descriptions(root_dir, d):
+    alternates = make_shared_objects(os.path.join(repo, 'shared.git'))
+    domains = [('main', TOPLEVEL_BUILD_DESC.format(repo=repo), 'main0', 'main'),
+               ('subdomain1', SUBDOMAIN1_BUILD_DESC.format(repo=repo),
+                'subdomain1', 'subdomain1'),
+               ('subdomain2', SUBDOMAIN2_BUILD_DESC.format(repo=repo),
+                'subdomain2', 'subdomain2'),
+               ('subdomain3', SUBDOMAIN3_BUILD_DESC,
+                'subdomain3', 'subdomain3'),
+              ]
+
+    failures = []
+    def make_one(name, build_desc, main_progname, main_desc):
+        try:
+            make_domain_repos(os.path.join(repo, name), build_desc,
+                              main_progname, main_desc, alternates)
+        except Exception as e:
+            failures.append((name, e))
+
+    threads = [threading.Thread(target=make_one, args=domain) for domain in domains]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise GiveUp('Error creating repositories for %s'%', '.join(
+                     '%s: %s'%(name, e) for name, e in failures))
+
+def checkout_build_descriptions(root_dir, build_dir):
 
     repo = os.path.join(root_dir, 'repo')
-    muddle(['init', 'git+file://{repo}/main'.format(repo=repo), 'builds/01.py'])
+    muddle(['init', 'git+file://{repo}/main'.format(repo=repo), 'builds/01.py'],
+           cwd=build_dir)
 
-    check_files([d.join('src', 'builds', '01.py'),
-                 d.join('domains', 'subdomain1', 'src', 'builds', '01.py'),
-                 d.join('domains', 'subdomain1', 'domains', 'subdomain3', 'src', 'builds', '01.py'),
-                 d.join('domains', 'subdomain2', 'src', 'builds', '01.py'),
+    check_files([os.path.join(build_dir, 'src', 'builds', '01.py'),
+                 os.path.join(build_dir, 'domains', 'subdomain1', 'src', 'builds', '01.py'),
+                 os.path.join(build_dir, 'domains', 'subdomain1', 'domains', 'subdomain3', 'src', 'builds', '01.py'),
+                 os.path.join(build_dir, 'domains', 'subdomain2', 'src', 'builds', '01.py'),
                 ])
 
-def check_checkout_files(d):
+def check_checkout_files(build_dir):
     """Check we have all the files we should have after checkout
 
-    'd' is the current Directory.
+    'build_dir' is the path to the top of the build tree.
     """
-    def check_dot_muddle(is_subdomain):
-        with Directory('.muddle') as m:
-            check_files([m.join('Description'),
-                         m.join('RootRepository'),
-                         m.join('VersionsRepository')])
-
-            if is_subdomain:
-                check_files([m.join('am_subdomain')])
-
-            with Directory(m.join('tags', 'checkout')) as c:
-                check_files([c.join('builds', 'checked_out'),
-                             c.join('first_co', 'checked_out'),
-                             c.join('main_co', 'checked_out'),
-                             c.join('second_co', 'checked_out')])
-
-    def check_src_files(main_c_file='main0.c'):
-        check_files([s.join('builds', '01.py'),
-                     s.join('main_co', 'Makefile.muddle'),
-                     s.join('main_co', main_c_file),
-                     s.join('first_co', 'Makefile.muddle'),
-                     s.join('first_co', 'first.c'),
-                     s.join('second_co', 'Makefile.muddle'),
-                     s.join('second_co', 'second.c')])
-
-    check_dot_muddle(is_subdomain=False)
-    with Directory('src') as s:
-        check_src_files('main0.c')
-
-    with Directory(d.join('domains', 'subdomain1', 'src')) as s:
-        check_src_files('subdomain1.c')
-    with Directory(d.join('domains', 'subdomain1')):
-        check_dot_muddle(is_subdomain=True)
-
-    with Directory(d.join('domains', 'subdomain1', 'domains', 'subdomain3', 'src')) as s:
-        check_src_files('subdomain3.c')
-    with Directory(d.join('domains', 'subdomain1', 'domains', 'subdomain3')):
-        check_dot_muddle(is_subdomain=True)
-
-    with Directory(d.join('domains', 'subdomain2', 'src')) as s:
-        check_src_files('subdomain2.c')
-    with Directory(d.join('domains', 'subdomain2')):
-        check_dot_muddle(is_subdomain=True)
-
-def add_some_instructions(d):
+    def check_dot_muddle(domain_dir, is_subdomain):
+        m = os.path.join(domain_dir, '.muddle')
+        c = os.path.join(m, 'tags', 'checkout')
+        paths = [os.path.join(m, 'Description'),
+                 os.path.join(m, 'RootRepository'),
+                 os.path.join(m, 'VersionsRepository'),
+                 os.path.join(c, 'builds', 'checked_out'),
+                 os.path.join(c, 'first_co', 'checked_out'),
+                 os.path.join(c, 'main_co', 'checked_out'),
+                 os.path.join(c, 'second_co', 'checked_out')]
+        if is_subdomain:
+            paths.append(os.path.join(m, 'am_subdomain'))
+        check_files(paths)
+
+    def check_src_files(domain_dir, main_c_file='main0.c'):
+        s = os.path.join(domain_dir, 'src')
+        check_files([os.path.join(s, 'builds', '01.py'),
+                     os.path.join(s, 'main_co', 'Makefile.muddle'),
+                     os.path.join(s, 'main_co', main_c_file),
+                     os.path.join(s, 'first_co', 'Makefile.muddle'),
+                     os.path.join(s, 'first_co', 'first.c'),
+                     os.path.join(s, 'second_co', 'Makefile.muddle'),
+                     os.path.join(s, 'second_co', 'second.c')])
+
+    check_dot_muddle(build_dir, is_subdomain=False)
+    check_src_files(build_dir, 'main0.c')
+
+    subdomain1 = os.path.join(build_dir, 'domains', 'subdomain1')
+    check_src_files(subdomain1, 'subdomain1.c')
+    check_dot_muddle(subdomain1, is_subdomain=True)
+
+    subdomain3 = os.path.join(subdomain1, 'domains', 'subdomain3')
+    check_src_files(subdomain3, 'subdomain3.c')
+    check_dot_muddle(subdomain3, is_subdomain=True)
+
+    subdomain2 = os.path.join(build_dir, 'domains', 'subdomain2')
+    check_src_files(subdomain2, 'subdomain2.c')
+    check_dot_muddle(subdomain2, is_subdomain=True)
+
+def add_some_instructions(build_dir):
     """Add some instruction file by hand.
 
     We should do this properly, via Makefiles copying instructions with
     ``$(MUDDLE_INSTRUCT)``, but this is simpler.
     """
-    with Directory('.muddle'):
-        with NewDirectory('instructions'):
-            with NewDirectory('first_pkg'):
-                touch('_default.xml', INSTRUCTIONS)
-            with NewDirectory('second_pkg'):
-                touch('_default.xml', INSTRUCTIONS)
-                touch('x86.xml', INSTRUCTIONS)
-                touch('arm.xml', INSTRUCTIONS)
-                touch('fred.xml', INSTRUCTIONS)     # How did that get here?
+    instructions = os.path.join(build_dir, '.muddle', 'instructions')
+    # (All of the files have the same content, and "fred.xml" is for a role
+    # we don't have - how did that get here?)
+    for pkg, filenames in [('first_pkg', ['_default.xml']),
+                           ('second_pkg', ['_default.xml', 'x86.xml',
+                                           'arm.xml', 'fred.xml'])]:
+        pkg_dir = os.path.join(instructions, pkg)
+        os.makedirs(pkg_dir)
+        for filename in filenames:
+            with open(os.path.join(pkg_dir, filename), 'w') as fd:
+                fd.write(INSTRUCTIONS)
+
+def distribute_cwd(ref_tree, subdir=None):
+    """Where should we run "muddle distribute" for 'ref_tree'?
+    """
+    if subdir:
+        return os.path.join(ref_tree.path, subdir)
+    else:
+        return ref_tree.path
+
+def check_hard_linked(ref_tree, target_dir, linked):
+    """Check that 'linked' was hard linked into 'target_dir'.
+
+    'linked' is a path relative to the top of the build tree (which is
+    'ref_tree.path') and 'target_dir'. If it is None, there is nothing to
+    check.
+    """
+    if linked is None:
+        return
+    if not os.path.samefile(os.path.join(ref_tree.path, linked),
+                            os.path.join(target_dir, linked)):
+        raise GiveUp('%s in %s is not hard linked to the build tree'%(linked,
+                     target_dir))
+
+def check_distribute(ref_tree, root_dir, target_name, args, unwanted_files,
+                     builds=False, subdir=None, linked=None):
+    """Distribute our build tree, and check the result.
+
+    'ref_tree' is a snapshot DirTree of the (already built) build tree, which
+    is shared by all of our distribute tests. 'args' are the arguments for
+    "muddle distribute", without the target directory, which will be
+    'target_name' within 'root_dir'.
+
+    See DirTree.assert_same() for how 'unwanted_files' is interpreted.
+
+    If 'builds' is true, then the distribution is expected to build things
+    in the build tree (a binary distribution builds anything not yet built),
+    so we re-take the snapshot afterwards.
+
+    Muddle is run at the top of the build tree, or in its 'subdir' directory
+    if that is given.
+
+    If 'linked' is given, it is a file that should have been hard linked
+    from the build tree, rather than copied.
+    """
+    target_dir = os.path.join(root_dir, target_name)
+    cwd = distribute_cwd(ref_tree, subdir)
+    # Each distribution needs a freshly loaded builder, as distributing adds
+    # rules to it and sets /distribute tags, which would otherwise leak into
+    # the next distribution - so we don't try to share one between them.
+    # Running muddle in-process still gives us that (each command loads its
+    # own builder), without paying for a new Python each time
+    with Directory(cwd, show_pushd=False):
+        run_muddle_directly(['distribute'] + args + [target_dir])
+    if builds:
+        ref_tree.snapshot()
+    ref_tree.assert_same(target_dir, onedown=True, unwanted_files=unwanted_files)
+    check_hard_linked(ref_tree, target_dir, linked)
+
+def make_build_tree(root_dir, build_dir):
+    """Check out, build and stamp our build tree, in 'build_dir'.
+
+    This is the (expensive) setup shared by all of the distribute tests.
+    """
+    os.makedirs(build_dir)
+    banner('CHECK REPOSITORIES OUT')
+    checkout_build_descriptions(root_dir, build_dir)
+    muddle(['checkout', '_all'], cwd=build_dir)
+    check_checkout_files(build_dir)
+    banner('BUILD')
+    muddle([], cwd=build_dir)
+    banner('STAMP VERSION')
+    muddle(['stamp', 'version'], cwd=build_dir)
+    banner('ADD SOME INSTRUCTIONS')
+    add_some_instructions(build_dir)
+
+# The files we don't expect in a "vertical" distribution, whatever else
+# we ask for
+VERTICAL_UNWANTED = [
+    'builds/01.pyc',
+    # -- Checkouts
+    'src/main_co',
+    'src/first_co',
+    # We want src/second_co
+    # -- Packages: obj
+    'obj/main_pkg',
+    'obj/first_pkg',
+    # We want obj/second_pkg
+    # -- Packages: install
+    'install/arm',
+    # We want install/x86/second, but have no
+    # way to stop getting ALL of install/x86
+    # -- Subdomains
+    # We've not asked for owt in subdomain2
+    'domains/subdomain2',
+    # -- Deployments
+    'deploy',
+    # -- Tags
+    # We want tags for second_co and second_pkg
+    '.muddle/tags/checkout/main_co',
+    '.muddle/tags/checkout/first_co',
+    '.muddle/tags/package/main_pkg',
+    '.muddle/tags/package/first_pkg',
+    '.muddle/tags/deployment',
+    # -- etc
+    '.muddle/instructions/first_pkg',
+    '.muddle/instructions/second_pkg/arm.xml',
+    '.muddle/instructions/second_pkg/fred.xml',
+    ]
+
+# Our distribution tests. Each is a tuple of:
+#
+#   * the title for its banner
+#   * the name of the directory (within the test directory) to distribute into
+#   * the arguments for "muddle distribute", apart from that directory
+#   * the files we don't expect to be distributed, as for DirTree.assert_same()
+#   * any other keyword arguments for check_distribute() (but note that
+#     check_distributions_in_parallel() only understands 'subdir' and 'linked')
+DISTRIBUTIONS = [
+    ('SOURCE RELEASE',
+     'source', ['_source_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      'versions',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    # Issue 250
+    ('SOURCE RELEASE when in a subdirectory',
+     'source-2', ['_source_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      'versions',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {'subdir': 'src/builds'}),
+
+    ('SOURCE RELEASE WITH VCS',
+     'source-with-vcs', ['-with-vcs', '_source_release'],
+     ['builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      'versions',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    ('SOURCE RELEASE WITH VERSIONS',
+     'source-with-versions', ['-with-versions', '_source_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    ('SOURCE RELEASE WITH VCS AND VERSIONS',
+     'source-with-vcs-and-versions',
+     ['-with-vcs', '-with-versions', '_source_release'],
+     ['builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    # Hint: it shouldn't make any difference at all
+    ('SOURCE RELEASE WITH "-no-muddle-makefile"',
+     'source-no-muddle-makefile', ['-no-muddle-makefile', '_source_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      'versions',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    # Hard links shouldn't make any difference to what we get, either
+    ('SOURCE RELEASE WITH "-hard-links"',
+     'source-hard-links', ['-hard-links', '_source_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'obj',
+      'install',
+      'deploy',
+      'versions',
+      '.muddle/instructions',
+      '.muddle/tags/package',
+      '.muddle/tags/deployment',
+     ], {'linked': 'src/first_co/first.c'}),
+
+    ('BINARY RELEASE',
+     'binary', ['_binary_release'],
+     ['.git*',
+      'builds/01.pyc',
+      '*.c',
+      'obj',
+      'deploy',
+      'versions',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      '.muddle/tags/deployment',
+     ], {'builds': True}),
+
+    ('BINARY RELEASE WITHOUT MUDDLE MAKEFILE',
+     'binary-no-muddle-makefile', ['-no-muddle-makefile', '_binary_release'],
+     ['.git*',
+      'builds/01.pyc',
+      'src/*co',  # no checkouts other than build
+      'obj',
+      'deploy',
+      'versions',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    ('BINARY RELEASE WITH VERSIONS',
+     'binary-with-versions', ['-with-versions', '_binary_release'],
+     ['.git*',
+      'builds/01.pyc',
+      '*.c',
+      'obj',
+      'deploy',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    ('BINARY RELEASE WITH VERSIONS AND VCS',
+     'binary-with-versions-and-vcs',
+     ['-with-versions', '-with-vcs', '_binary_release'],
+     ['builds/01.pyc',
+      '*.c',
+      'src/*_co/.git*',
+      'obj',
+      'deploy',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      '.muddle/tags/deployment',
+     ], {}),
+
+    ('BINARY RELEASE WITH "-hard-links"',
+     'binary-hard-links', ['-hard-links', '_binary_release'],
+     ['.git*',
+      'builds/01.pyc',
+      '*.c',
+      'obj',
+      'deploy',
+      'versions',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      '.muddle/tags/deployment',
+     ], {'linked': 'install/x86/first'}),
+
+    ('"mixed"',
+     'mixed', ['mixed'],
+     ['.git*',
+      'builds/01.pyc',
+      # -- Checkouts
+      'src/main_co',
+      # We want src/first_co
+      # We want the Makefile.muddle in second_co
+      'src/second_co/*.c',
+      # -- Domains
+      'domains', # we don't want any subdomains
+      # -- Packages: obj
+      'obj/main_pkg',
+      'obj/first_pkg',
+      # We want obj/second_pkg
+      # -- Not install/
+      'install',
+      # -- Deployments
+      'deploy',
+      # -- Tags
+      # We explicitly want tags for first_co
+      # We implicitly want tags for second_co,
+      # because we have package first_pkg which
+      # depends on it
+      '.muddle/tags/checkout/main_co',
+      '.muddle/tags/package/main_pkg',
+      '.muddle/tags/package/first_pkg',
+      '.muddle/tags/deployment',
+      # but we're not transferring install/,
+      # so we don't want [post]installed tags
+      '.muddle/tags/package/second_pkg/*-*installed',
+      # -- etc
+      '.muddle/instructions/first_pkg',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      'versions',
+     ], {}),
+
+    # Again, shouldn't make any difference
+    ('"mixed" WITH "-no-muddle-makefile"',
+     'mixed-no-muddle-makefile', ['-no-muddle-makefile', 'mixed'],
+     ['.git*',
+      'builds/01.pyc',
+      # -- Checkouts
+      'src/main_co',
+      # We want src/first_co
+      # We want the Makefile.muddle in second_co
+      'src/second_co/*.c',
+      # -- Domains
+      'domains', # we don't want any subdomains
+      # -- Packages: obj
+      'obj/main_pkg',
+      'obj/first_pkg',
+      # We want obj/second_pkg
+      # -- Not install/
+      'install',
+      # -- Deployments
+      'deploy',
+      # -- Tags
+      # We explicitly want tags for first_co
+      # We implicitly want tags for second_co,
+      # because we have package first_pkg which
+      # depends on it
+      '.muddle/tags/checkout/main_co',
+      '.muddle/tags/package/main_pkg',
+      '.muddle/tags/package/first_pkg',
+      '.muddle/tags/deployment',
+      # but we're not transferring install/,
+      # so we don't want [post]installed tags
+      '.muddle/tags/package/second_pkg/*-*installed',
+      # -- etc
+      '.muddle/instructions/first_pkg',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      'versions',
+     ], {}),
+
+    ('"role-x86"',
+     'role-x86', ['role-x86'],
+     ['.git*',
+      'builds/01.pyc',
+      'deploy',
+      '.muddle/tags/deployment',
+      'domains',   # we didn't ask for subdomains
+      'versions',
+      '.muddle/instructions/second_pkg/arm.xml',
+      '.muddle/instructions/second_pkg/fred.xml',
+      # We only want role x86, not role arm
+      '.muddle/tags/package/main_pkg/arm-*',
+      'obj/main_pkg/arm',
+      'install/arm',
+     ], {}),
+
+    ('"vertical"',
+     'vertical', ['vertical'],
+     ['.git*'] + VERTICAL_UNWANTED + ['versions'], {}),
+
+    # Remember, we're asking for VCS in the build description and version
+    # directories, but not changing what the build description says for
+    # explicitly asked for checkouts...
+    ('"vertical" WITH VCS AND VERSIONS',
+     'vertical-with-vcs-and-versions',
+     ['-with-vcs', '-with-versions', 'vertical'],
+     # We want src/second_co, but we didn't ask for its VCS
+     VERTICAL_UNWANTED + ['src/second_co/.git*'], {}),
+]
+
+def _run_distribute(args):
+    """Run "muddle distribute" as a separate process, with output to 'log_name'.
+
+    Returns muddle's exit code.
+    """
+    muddle_args, cwd, log_name = args
+    # Muddle believes PWD in preference to its actual directory
+    env = os.environ.copy()
+    env['PWD'] = cwd
+    with open(log_name, 'w') as log:
+        return subprocess.call([MUDDLE_BINARY] + muddle_args, cwd=cwd, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+def check_distributions_in_parallel(ref_tree, root_dir, batch):
+    """Check a batch of distributions that can all be done at once.
+
+    'batch' is a list of entries from DISTRIBUTIONS, none of which may build
+    anything in the build tree.
+
+    We can't run several muddles in-process at the same time (they would
+    share our current directory, amongst other things), so each runs as its
+    own muddle process, with its output going to a log file next to its
+    target directory. We then show each log in turn, and check the results.
+    """
+    target_dirs = [os.path.join(root_dir, target_name)
+                   for title, target_name, args, unwanted_files, options in batch]
+    tasks = []
+    for (title, target_name, args, unwanted_files, options), target_dir in \
+            zip(batch, target_dirs):
+        tasks.append((['distribute'] + args + [target_dir],
+                      distribute_cwd(ref_tree, options.get('subdir')),
+                      target_dir + '.log'))
+
+    # Distributing is mostly waiting for files to be read and written, so
+    # it's worth having more of them going than we have CPUs
+    pool = ThreadPool(min(len(tasks), multiprocessing.cpu_count() * 4))
+    try:
+        retcodes = pool.map(_run_distribute, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    for (title, target_name, args, unwanted_files, options), target_dir, \
+            (muddle_args, cwd, log_name), retcode in zip(batch, target_dirs,
+                                                         tasks, retcodes):
+        banner('TESTING DISTRIBUTE %s'%title)
+        print('++ muddle %s'%' '.join(muddle_args))
+        with open(log_name) as log:
+            sys.stdout.write(log.read())
+        if retcode:
+            raise ShellError('muddle %s'%' '.join(muddle_args), retcode)
+        ref_tree.assert_same(target_dir, onedown=True,
+                             unwanted_files=unwanted_files)
+        check_hard_linked(ref_tree, target_dir, options.get('linked'))
+
+def check_distributions(root_dir, build_dir):
+    """Check each of our different sorts of distribution.
+
+    Each distribution goes into its own directory within 'root_dir', and
+    none of them alter the build tree itself (apart from the first binary
+    distribution, which builds the packages not built by default), so they
+    can all share it - and compare against the same snapshot of it.
+
+    So the distributions between those that build things are run in
+    parallel, and those that do build things are run on their own.
+    """
+    ref_tree = DirTree(build_dir, fold_dirs=['.git']).snapshot()
+
+    batch = []
+    for distribution in DISTRIBUTIONS:
+        title, target_name, args, unwanted_files, options = distribution
+        if not options.get('builds'):
+            batch.append(distribution)
+            continue
+        if batch:
+            check_distributions_in_parallel(ref_tree, root_dir, batch)
+            batch = []
+        banner('TESTING DISTRIBUTE %s'%title)
+        check_distribute(ref_tree, root_dir, target_name, args, unwanted_files,
+                         **options)
+    if batch:
+        check_distributions_in_parallel(ref_tree, root_dir, batch)
+
+    # Distributing with hard links into a directory we've already distributed
+    # into means linking files that are already there (as the same file)
+    for title, target_name, args, unwanted_files, options in DISTRIBUTIONS:
+        if '-hard-links' in args:
+            banner('TESTING DISTRIBUTE %s AGAIN, INTO THE SAME DIRECTORY'%title)
+            check_distribute(ref_tree, root_dir, target_name, args,
+                             unwanted_files, **options)
+
+def disable_git_fsync():
+    """Stop git from syncing the repositories we create to disk.
+
+    We don't care if our test repositories survive a crash, and this saves
+    a lot of time on some filesystems. It also applies when muddle runs git
+    for us. Versions of git older than 2.36 just ignore it.
+    """
+    count = int(os.environ.get('GIT_CONFIG_COUNT', '0'))
+    os.environ['GIT_CONFIG_KEY_%d'%count] = 'core.fsync'
+    os.environ['GIT_CONFIG_VALUE_%d'%count] = 'none'
+    os.environ['GIT_CONFIG_COUNT'] = str(count + 1)
 
 def main(args):
 
@@ -435,384 +1030,33 @@ def main(args):
         if len(args) == 1 and args[0] == '-keep':
             keep = True
         else:
-            print __doc__
+            print(__doc__)
             raise GiveUp('Unexpected arguments %s'%' '.join(args))
 
-    # Working in a local transient directory seems to work OK
-    # although if it's anyone other than me they might prefer
-    # somewhere in $TMPDIR...
-    root_dir = normalise_dir(os.path.join(os.getcwd(), 'transient'))
+    disable_git_fsync()
 
-    with TransientDirectory(root_dir, keep_on_error=True, keep_anyway=keep) as root_d:
+    # Work in a temporary directory, which is typically on a faster
+    # filesystem than our local directory
+    with TransientDirectory(None, keep_on_error=True, keep_anyway=keep) as root_d:
+        root_dir = root_d.where
 
         banner('MAKE REPOSITORIES')
         make_repos_with_subdomain(root_dir)
 
-        with NewDirectory('build') as d:
-            banner('CHECK REPOSITORIES OUT')
-            checkout_build_descriptions(root_dir, d)
-            muddle(['checkout', '_all'])
-            check_checkout_files(d)
-            banner('BUILD')
-            muddle([])
-            banner('STAMP VERSION')
-            muddle(['stamp', 'version'])
-            banner('ADD SOME INSTRUCTIONS')
-            add_some_instructions(d)
-
-            banner('TESTING DISTRIBUTE SOURCE RELEASE')
-            target_dir = os.path.join(root_dir, 'source')
-            muddle(['distribute', '_source_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           'obj',
-                                           'install',
-                                           'deploy',
-                                           'versions',
-                                           '.muddle/instructions',
-                                           '.muddle/tags/package',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            # Issue 250
-            banner('TESTING DISTRIBUTE SOURCE RELEASE when in a subdirectory')
-            with Directory('src/builds'):
-                target_dir = os.path.join(root_dir, 'source-2')
-                muddle(['distribute', '_source_release', target_dir])
-                dt = DirTree(d.where, fold_dirs=['.git'])
-                dt.assert_same(target_dir, onedown=True,
-                               unwanted_files=['.git*',
-                                               'builds/01.pyc',
-                                               'obj',
-                                               'install',
-                                               'deploy',
-                                               'versions',
-                                               '.muddle/instructions',
-                                               '.muddle/tags/package',
-                                               '.muddle/tags/deployment',
-                                              ])
-
-            banner('TESTING DISTRIBUTE SOURCE RELEASE WITH VCS')
-            target_dir = os.path.join(root_dir, 'source-with-vcs')
-            muddle(['distribute', '-with-vcs', '_source_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=[
-                                           'builds/01.pyc',
-                                           'obj',
-                                           'install',
-                                           'deploy',
-                                           'versions',
-                                           '.muddle/instructions',
-                                           '.muddle/tags/package',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE SOURCE RELEASE WITH VERSIONS')
-            target_dir = os.path.join(root_dir, 'source-with-versions')
-            muddle(['distribute', '-with-versions', '_source_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           'obj',
-                                           'install',
-                                           'deploy',
-                                           '.muddle/instructions',
-                                           '.muddle/tags/package',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE SOURCE RELEASE WITH VCS AND VERSIONS')
-            target_dir = os.path.join(root_dir, 'source-with-vcs-and-versions')
-            muddle(['distribute', '-with-vcs', '-with-versions', '_source_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=[
-                                           'builds/01.pyc',
-                                           'obj',
-                                           'install',
-                                           'deploy',
-                                           '.muddle/instructions',
-                                           '.muddle/tags/package',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE SOURCE RELEASE WITH "-no-muddle-makefile"')
-            # Hint: it shouldn't make any difference at all
-            target_dir = os.path.join(root_dir, 'source-no-muddle-makefile')
-            muddle(['distribute', '-no-muddle-makefile', '_source_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           'obj',
-                                           'install',
-                                           'deploy',
-                                           'versions',
-                                           '.muddle/instructions',
-                                           '.muddle/tags/package',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE BINARY RELEASE')
-            target_dir = os.path.join(root_dir, 'binary')
-            muddle(['distribute', '_binary_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           '*.c',
-                                           'obj',
-                                           'deploy',
-                                           'versions',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE BINARY RELEASE WITHOUT MUDDLE MAKEFILE')
-            target_dir = os.path.join(root_dir, 'binary-no-muddle-makefile')
-            muddle(['distribute', '-no-muddle-makefile', '_binary_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           'src/*co',  # no checkouts other than build
-                                           'obj',
-                                           'deploy',
-                                           'versions',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE BINARY RELEASE WITH VERSIONS')
-            target_dir = os.path.join(root_dir, 'binary-with-versions')
-            muddle(['distribute', '-with-versions', '_binary_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           '*.c',
-                                           'obj',
-                                           'deploy',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE BINARY RELEASE WITH VERSIONS AND VCS')
-            target_dir = os.path.join(root_dir, 'binary-with-versions-and-vcs')
-            muddle(['distribute', '-with-versions', '-with-vcs', '_binary_release', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=[
-                                           'builds/01.pyc',
-                                           '*.c',
-                                           'src/*_co/.git*',
-                                           'obj',
-                                           'deploy',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           '.muddle/tags/deployment',
-                                          ])
-
-            banner('TESTING DISTRIBUTE "mixed"')
-            target_dir = os.path.join(root_dir, 'mixed')
-            muddle(['distribute', 'mixed', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           # -- Checkouts
-                                           'src/main_co',
-                                           # We want src/first_co
-                                           # We want the Makefile.muddle in second_co
-                                           'src/second_co/*.c',
-                                           # -- Domains
-                                           'domains', # we don't want any subdomains
-                                           # -- Packages: obj
-                                           'obj/main_pkg',
-                                           'obj/first_pkg',
-                                           # We want obj/second_pkg
-                                           # -- Not install/
-                                           'install',
-                                           # -- Deployments
-                                           'deploy',
-                                           # -- Tags
-                                           # We explicitly want tags for first_co
-                                           # We implicitly want tags for second_co,
-                                           # because we have package first_pkg which
-                                           # depends on it
-                                           '.muddle/tags/checkout/main_co',
-                                           '.muddle/tags/package/main_pkg',
-                                           '.muddle/tags/package/first_pkg',
-                                           '.muddle/tags/deployment',
-                                           # but we're not transferring install/,
-                                           # so we don't want [post]installed tags
-                                           '.muddle/tags/package/second_pkg/*-*installed',
-                                           # -- etc
-                                           '.muddle/instructions/first_pkg',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           'versions',
-                                          ])
-
-            banner('TESTING DISTRIBUTE "mixed" WITH "-no-muddle-makefile"')
-            # Again, shouldn't make any difference
-            target_dir = os.path.join(root_dir, 'mixed')
-            muddle(['distribute', 'mixed', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           # -- Checkouts
-                                           'src/main_co',
-                                           # We want src/first_co
-                                           # We want the Makefile.muddle in second_co
-                                           'src/second_co/*.c',
-                                           # -- Domains
-                                           'domains', # we don't want any subdomains
-                                           # -- Packages: obj
-                                           'obj/main_pkg',
-                                           'obj/first_pkg',
-                                           # We want obj/second_pkg
-                                           # -- Not install/
-                                           'install',
-                                           # -- Deployments
-                                           'deploy',
-                                           # -- Tags
-                                           # We explicitly want tags for first_co
-                                           # We implicitly want tags for second_co,
-                                           # because we have package first_pkg which
-                                           # depends on it
-                                           '.muddle/tags/checkout/main_co',
-                                           '.muddle/tags/package/main_pkg',
-                                           '.muddle/tags/package/first_pkg',
-                                           '.muddle/tags/deployment',
-                                           # but we're not transferring install/,
-                                           # so we don't want [post]installed tags
-                                           '.muddle/tags/package/second_pkg/*-*installed',
-                                           # -- etc
-                                           '.muddle/instructions/first_pkg',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           'versions',
-                                          ])
-
-            banner('TESTING DISTRIBUTE "role-x86"')
-            target_dir = os.path.join(root_dir, 'role-x86')
-            muddle(['distribute', 'role-x86', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           'deploy',
-                                           '.muddle/tags/deployment',
-                                           'domains',   # we didn't ask for subdomains
-                                           'versions',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           # We only want role x86, not role arm
-                                           '.muddle/tags/package/main_pkg/arm-*',
-                                           'obj/main_pkg/arm',
-                                           'install/arm',
-                                          ])
-
-            banner('TESTING DISTRIBUTE "vertical"')
-            target_dir = os.path.join(root_dir, 'vertical')
-            muddle(['distribute', 'vertical', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=['.git*',
-                                           'builds/01.pyc',
-                                           # -- Checkouts
-                                           'src/main_co',
-                                           'src/first_co',
-                                           # We want src/second_co
-                                           # -- Packages: obj
-                                           'obj/main_pkg',
-                                           'obj/first_pkg',
-                                           # We want obj/second_pkg
-                                           # -- Packages: install
-                                           'install/arm',
-                                           # We want install/x86/second, but have no
-                                           # way to stop getting ALL of install/x86
-                                           # -- Subdomains
-                                           # We've not asked for owt in subdomain2
-                                           'domains/subdomain2',
-                                           # -- Deployments
-                                           'deploy',
-                                           # -- Tags
-                                           # We want tags for second_co and second_pkg
-                                           '.muddle/tags/checkout/main_co',
-                                           '.muddle/tags/checkout/first_co',
-                                           '.muddle/tags/package/main_pkg',
-                                           '.muddle/tags/package/first_pkg',
-                                           '.muddle/tags/deployment',
-                                           # -- etc
-                                           '.muddle/instructions/first_pkg',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                           'versions',
-                                         ])
-
-            banner('TESTING DISTRIBUTE "vertical" WITH VCS AND VERSIONS')
-            target_dir = os.path.join(root_dir, 'vertical-with-vcs-and-versions')
-            # Remember, we're asking for VCS in the build description and version
-            # directories, but not changing what the build description says for
-            # explicitly asked for checkouts...
-            muddle(['distribute', '-with-vcs', '-with-versions', 'vertical', target_dir])
-            dt = DirTree(d.where, fold_dirs=['.git'])
-            dt.assert_same(target_dir, onedown=True,
-                           unwanted_files=[
-                                           'builds/01.pyc',
-                                           # -- Checkouts
-                                           'src/main_co',
-                                           'src/first_co',
-                                           # We want src/second_co, but we didn't
-                                           # ask for its VCS
-                                           'src/second_co/.git*',
-                                           # -- Packages: obj
-                                           'obj/main_pkg',
-                                           'obj/first_pkg',
-                                           # We want obj/second_pkg
-                                           # -- Packages: install
-                                           'install/arm',
-                                           # We want install/x86/second, but have no
-                                           # way to stop getting ALL of install/x86
-                                           # -- Subdomains
-                                           # We've not asked for owt in subdomain2
-                                           'domains/subdomain2',
-                                           # -- Deployments
-                                           'deploy',
-                                           # -- Tags
-                                           # We want tags for second_co and second_pkg
-                                           '.muddle/tags/checkout/main_co',
-                                           '.muddle/tags/checkout/first_co',
-                                           '.muddle/tags/package/main_pkg',
-                                           '.muddle/tags/package/first_pkg',
-                                           '.muddle/tags/deployment',
-                                           # -- etc
-                                           '.muddle/instructions/first_pkg',
-                                           '.muddle/instructions/second_pkg/arm.xml',
-                                           '.muddle/instructions/second_pkg/fred.xml',
-                                         ])
-
+        build_dir = os.path.join(root_dir, 'build')
+        make_build_tree(root_dir, build_dir)
+        check_distributions(root_dir, build_dir)
 
 
 if __name__ == '__main__':
     args = sys.argv[1:]
     try:
         main(args)
-        print '\nGREEN light\n'
+        print('\nGREEN light\n')
     except Exception as e:
-        print
+        print()
         traceback.print_exc()
-        print '\nRED light\n'
+        print('\nRED light\n')
         sys.exit(1)
 
 # vim: set tabstop=8 softtabstop=4 shiftwidth=4 expandtab:
@@ -686,10 +686,13 @@ def test_build_with_clashes(root_dir):
 def main_tests(root_dir, d):
     """The main set of tests.
     """
+    # None of these distributions change our build tree, so we only need
+    # to look at it once
+    dt = DirTree(d.where, fold_dirs=['.git']).snapshot()
+
     banner('TESTING DISTRIBUTE SOURCE RELEASE')
     target_dir = os.path.join(root_dir, '_source_release')
     muddle(['distribute', '_source_release', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -705,7 +708,6 @@ def main_tests(root_dir, d):
     banner('TESTING DISTRIBUTE BINARY RELEASE')
     target_dir = os.path.join(root_dir, '_binary_release')
     muddle(['distribute', '_binary_release', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -725,7 +727,6 @@ def main_tests(root_dir, d):
     banner('TESTING DISTRIBUTE FOR GPL')
     target_dir = os.path.join(root_dir, '_for_gpl')
     muddle(['distribute', '_for_gpl', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -768,7 +769,6 @@ def main_tests(root_dir, d):
     banner('TESTING DISTRIBUTE FOR ALL OPEN')
     target_dir = os.path.join(root_dir, '_all_open')
     muddle(['distribute', '_all_open', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -803,7 +803,6 @@ def main_tests(root_dir, d):
     banner('TESTING DISTRIBUTE FOR BY LICENSE')
     target_dir = os.path.join(root_dir, '_by_license')
     muddle(['distribute', '_by_license', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -865,7 +864,6 @@ def main_tests(root_dir, d):
     # it is indeed working as expected...
     target_dir = os.path.join(root_dir, 'just_open_src_and_bin')
     muddle(['distribute', 'just_open_src_and_bin', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -942,7 +940,6 @@ package:(subdomain)xyzlib{x86}/distributed DistributePackage: just_open_src_and_
     # not "binaries and private-source".
     target_dir = os.path.join(root_dir, 'binary_and_private_source')
     muddle(['distribute', 'binary_and_private_source', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -999,7 +996,6 @@ package:(subdomain)xyzlib{x86}/distributed DistributePackage: just_open_src_and_
     # So this is, again, a test of what we can't do as well as what we can.
     target_dir = os.path.join(root_dir, 'binary_and_private_install')
     muddle(['distribute', 'binary_and_private_install', target_dir])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',
@@ -1069,7 +1065,6 @@ package:(subdomain)xyzlib{x86}/distributed DistributePackage: just_open_src_and_
     # we can't discriminate on just things built for binary1
     target_dir = os.path.join(root_dir, '_by_license_something')
     muddle(['distribute', '_by_license', target_dir, 'deployment:something'])
-    dt = DirTree(d.where, fold_dirs=['.git'])
     dt.assert_same(target_dir, onedown=True,
                    unwanted_files=['.git*',
                                    'src/builds*/*.pyc',